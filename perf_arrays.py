@@ -0,0 +1,54 @@
+import timeit
+
+import numpy as np
+
+from reg import dispatch
+from reg import DictCachingKeyLookup
+
+ROWS = 100000
+
+
+class Foo:
+    pass
+
+
+class Bar:
+    pass
+
+
+class Qux:
+    pass
+
+
+@dispatch("a", "b", get_key_lookup=DictCachingKeyLookup)
+def args2(a, b):
+    return "fallback"
+
+
+args2.register(lambda a, b: "foo", a=Foo, b=Foo)
+args2.register(lambda a, b: "bar", a=Bar, b=Foo)
+
+classes = [Foo, Bar, Qux]
+a = np.array([classes[i % 3]() for i in range(ROWS)], dtype=object)
+b = np.array([Foo() for i in range(ROWS)], dtype=object)
+
+
+def call_each():
+    return [args2(x, y) for x, y in zip(a, b)]
+
+
+def call_map_arrays():
+    return args2.dispatch.map_arrays(a, b)
+
+
+assert list(call_map_arrays()) == call_each()
+
+print("\nDispatch over arrays")
+print("====================")
+print(f"{ROWS} rows")
+
+print("calling the dispatch function for each row")
+print(f"{min(timeit.repeat(call_each, number=1, repeat=5)):.3f}s")
+
+print("map_arrays")
+print(f"{min(timeit.repeat(call_map_arrays, number=1, repeat=5)):.3f}s")
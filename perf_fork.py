@@ -0,0 +1,96 @@
+import os
+import sys
+
+from reg import dispatch, prepare_for_fork
+from reg import DictCachingKeyLookup
+
+FUNCTIONS = 500
+CLASSES = 50
+WORKERS = 4
+
+
+classes = [type(f"Class{i}", (), {}) for i in range(CLASSES)]
+
+
+def make_dispatch_functions():
+    result = []
+    for i in range(FUNCTIONS):
+
+        @dispatch("a", "b", get_key_lookup=DictCachingKeyLookup)
+        def f(a, b):
+            raise NotImplementedError()
+
+        for class_ in classes:
+            f.register(lambda a, b: None, a=class_, b=class_)
+        result.append(f)
+    return result
+
+
+def unique_set_size():
+    """Memory that is private to this process, in kB."""
+    result = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                result += int(line.split()[1])
+    return result
+
+
+def work(functions):
+    instances = [class_() for class_ in classes]
+    for f in functions:
+        for instance in instances:
+            f(instance, instance)
+
+
+def fork_workers(functions):
+    """Average unique set size of the workers, in kB."""
+    pids = []
+    read_fds = []
+    for i in range(WORKERS):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            work(functions)
+            os.write(write_fd, str(unique_set_size()).encode())
+            os._exit(0)
+        os.close(write_fd)
+        pids.append(pid)
+        read_fds.append(read_fd)
+    sizes = []
+    for pid, read_fd in zip(pids, read_fds):
+        sizes.append(int(os.read(read_fd, 100)))
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+    return sum(sizes) / len(sizes)
+
+
+def measure(prepare):
+    # measure in a separate process, as gc.freeze affects the
+    # whole process
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        functions = make_dispatch_functions()
+        if prepare:
+            prepare_for_fork()
+        os.write(write_fd, str(fork_workers(functions)).encode())
+        os._exit(0)
+    os.close(write_fd)
+    result = float(os.read(read_fd, 100))
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return result
+
+
+if not os.path.exists("/proc/self/smaps_rollup"):
+    sys.exit("Measuring unique set size requires Linux")
+
+print("\nUnique memory per worker")
+print("========================")
+
+print("without prepare_for_fork")
+print(f"{measure(False):.0f} kB")
+
+print("with prepare_for_fork")
+print(f"{measure(True):.0f} kB")
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+import time
+
+RUNS = 20
+
+# Budget for the time import reg adds to the startup of the
+# interpreter, relative to the startup time itself. An absolute budget
+# would depend too much on the machine and on the state of its
+# bytecode caches.
+BUDGET = 0.5
+
+
+def run_time(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True)
+    return time.perf_counter() - start
+
+
+# warm up the bytecode caches, so that we don't measure compilation
+run_time("import reg")
+
+# We alternate the runs, so that both see the same load of the
+# machine, and take the fastest of each, which is least disturbed.
+startup_times = []
+import_times = []
+for i in range(RUNS):
+    startup_times.append(run_time("pass"))
+    import_times.append(run_time("import reg"))
+
+startup_time = min(startup_times)
+reg_time = min(import_times) - startup_time
+ratio = reg_time / startup_time
+
+print("\nImport time")
+print("===========")
+print("import reg")
+print(
+    f"{reg_time * 1e6:.0f} us, {ratio:.0%} of interpreter startup "
+    f"(budget: {BUDGET:.0%})"
+)
+
+if ratio > BUDGET:
+    sys.exit("import reg is over budget")
@@ -0,0 +1,83 @@
+import os
+import sys
+import threading
+import time
+
+try:
+    import _interpreters as interpreters
+except ImportError:
+    import _xxsubinterpreters as interpreters
+
+CALLS = 200000
+
+WORK = f"""\
+import sys
+sys.path[:] = {sys.path!r}
+
+from reg import dispatch
+from reg import DictCachingKeyLookup
+
+
+class Foo:
+    pass
+
+
+@dispatch("a", "b", get_key_lookup=DictCachingKeyLookup)
+def args2(a, b):
+    raise NotImplementedError()
+
+
+args2.register(lambda a, b: "args2", a=Foo, b=Foo)
+
+a = Foo()
+b = Foo()
+for i in range({CALLS}):
+    args2(a, b)
+"""
+
+
+def create_interpreter():
+    try:
+        # Python 3.12 needs to be asked for a GIL of its own
+        return interpreters.create(isolated=True)
+    except TypeError:
+        return interpreters.create()
+
+
+def run_in_interpreter():
+    interpreter = create_interpreter()
+    try:
+        interpreters.run_string(interpreter, WORK)
+    finally:
+        interpreters.destroy(interpreter)
+
+
+def run_in_main_interpreter():
+    exec(WORK, {})
+
+
+def duration(target, thread_count):
+    threads = [threading.Thread(target=target) for i in range(thread_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+thread_counts = [1]
+while thread_counts[-1] * 2 <= (os.cpu_count() or 1):
+    thread_counts.append(thread_counts[-1] * 2)
+
+print("\nDispatch in subinterpreters")
+print("===========================")
+print(f"{CALLS} dispatch calls per thread")
+
+for name, target in [
+    ("threads in the main interpreter", run_in_main_interpreter),
+    ("threads in their own subinterpreter", run_in_interpreter),
+]:
+    print(name)
+    for thread_count in thread_counts:
+        print(f"{thread_count} threads: {duration(target, thread_count):.2f}s")
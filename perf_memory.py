@@ -0,0 +1,79 @@
+import gc
+import tracemalloc
+
+from reg import dispatch, dispatch_method
+
+AMOUNT = 2000
+
+
+def make_dispatch_functions(amount):
+    result = []
+    for i in range(amount):
+
+        @dispatch("a", "b")
+        def f(a, b):
+            raise NotImplementedError()
+
+        result.append(f)
+    return result
+
+
+def make_dispatch_methods(amount):
+    result = []
+    for i in range(amount):
+
+        class App:
+            @dispatch_method("a", "b")
+            def f(self, a, b):
+                raise NotImplementedError()
+
+        # trigger the creation of the dispatch method
+        App.f
+        result.append(App)
+    return result
+
+
+def make_plain_classes(amount):
+    result = []
+    for i in range(amount):
+
+        class App:
+            def f(self, a, b):
+                raise NotImplementedError()
+
+        App.f
+        result.append(App)
+    return result
+
+
+def measure(factory):
+    # warm up, so that one-time costs like code caches are excluded
+    factory(10)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = factory(AMOUNT)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del objects
+    return size / AMOUNT
+
+
+print("Memory per dispatch function")
+print("=============================")
+
+print("dispatch function")
+print(f"{measure(make_dispatch_functions):.0f} bytes")
+
+print("dispatch method (including its class)")
+dispatch_methods = measure(make_dispatch_methods)
+print(f"{dispatch_methods:.0f} bytes")
+
+print("plain method (including its class)")
+plain_methods = measure(make_plain_classes)
+print(f"{plain_methods:.0f} bytes")
+
+print("dispatch method overhead")
+print(f"{dispatch_methods - plain_methods:.0f} bytes")
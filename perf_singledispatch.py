@@ -0,0 +1,50 @@
+import timeit
+from functools import singledispatch
+
+from reg import dispatch, DictCachingKeyLookup
+
+
+class Foo:
+    pass
+
+
+class FooSub(Foo):
+    pass
+
+
+@dispatch("obj")
+def reg_func(obj):
+    return "fallback"
+
+
+@dispatch("obj", get_key_lookup=DictCachingKeyLookup)
+def reg_cached_func(obj):
+    return "fallback"
+
+
+@singledispatch
+def single_func(obj):
+    return "fallback"
+
+
+def foo(obj):
+    return "foo"
+
+
+reg_func.register(foo, obj=Foo)
+reg_cached_func.register(foo, obj=Foo)
+single_func.register(Foo)(foo)
+
+obj = FooSub()
+
+print("Single argument type dispatch")
+print("=============================")
+
+for name, func in [
+    ("reg", reg_func),
+    ("reg with DictCachingKeyLookup", reg_cached_func),
+    ("functools.singledispatch", single_func),
+    ("plain function", foo),
+]:
+    print(name)
+    print(timeit.timeit(lambda: func(obj), number=1000000))
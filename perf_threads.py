@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+import time
+
+from reg import dispatch
+from reg import DictCachingKeyLookup, ThreadLocalCachingKeyLookup
+
+CALLS = 200000
+
+
+class Foo:
+    pass
+
+
+def myargs2(a, b):
+    return "args2"
+
+
+def make_dispatch(get_key_lookup):
+    @dispatch("a", "b", get_key_lookup=get_key_lookup)
+    def args2(a, b):
+        raise NotImplementedError()
+
+    args2.register(myargs2, a=Foo, b=Foo)
+    return args2
+
+
+def throughput(func, thread_count):
+    """Dispatch calls per second with thread_count threads."""
+    a = Foo()
+    b = Foo()
+    calls = CALLS // thread_count
+    barrier = threading.Barrier(thread_count + 1)
+
+    def run():
+        barrier.wait()
+        for i in range(calls):
+            func(a, b)
+
+    threads = [threading.Thread(target=run) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return calls * thread_count / (time.perf_counter() - start)
+
+
+is_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+thread_counts = [1]
+while thread_counts[-1] * 2 <= (os.cpu_count() or 1):
+    thread_counts.append(thread_counts[-1] * 2)
+
+print("\nThreaded dispatch throughput")
+print("============================")
+print("GIL enabled" if is_gil_enabled else "free-threaded")
+
+for name, get_key_lookup in [
+    ("DictCachingKeyLookup", DictCachingKeyLookup),
+    ("ThreadLocalCachingKeyLookup", ThreadLocalCachingKeyLookup),
+]:
+    func = make_dispatch(get_key_lookup)
+    func(Foo(), Foo())
+    base = throughput(func, 1)
+    print(name)
+    for thread_count in thread_counts:
+        result = throughput(func, thread_count)
+        print(
+            f"{thread_count} threads: {result:.0f} calls/s "
+            f"({result / base:.2f}x single thread)"
+        )
@@ -1,5 +1,13 @@
 # flake8: noqa
-from .dispatch import dispatch, Dispatch, LookupEntry
+from importlib import import_module
+
+from .dispatch import (
+    dispatch,
+    Dispatch,
+    DispatchGroup,
+    LookupEntry,
+    prepare_for_fork,
+)
 from .context import (
     dispatch_method,
     DispatchMethod,
@@ -15,5 +23,27 @@ from .predicate import (
     match_key,
     match_instance,
     match_class,
+    match_protocol,
+    key_scope,
 )
-from .cache import DictCachingKeyLookup, LruCachingKeyLookup
+
+# These are only imported when first accessed, so that importing reg
+# stays cheap for code that does not use them.
+_lazy_attributes = {
+    "DictCachingKeyLookup": ".cache",
+    "LruCachingKeyLookup": ".cache",
+    "ThreadLocalCachingKeyLookup": ".cache",
+}
+
+
+def __getattr__(name):
+    try:
+        module_name = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = getattr(import_module(module_name, __name__), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
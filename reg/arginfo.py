@@ -1,4 +1,4 @@
-import inspect
+from types import FunctionType, MethodType
 
 
 def arginfo(callable):
@@ -29,6 +29,9 @@ def arginfo(callable):
             return arginfo._cache[callable.__call__]
         except (AttributeError, KeyError):
             pass
+    # inspect is slow to import, so only do so when we actually need it.
+    import inspect
+
     func, cache_key, remove_self = get_callable_info(callable)
     if func is None:
         return None
@@ -74,11 +77,11 @@ def get_callable_info(callable):
 
     If not inspectable (None, None, False) is returned.
     """
-    if inspect.isfunction(callable):
+    if isinstance(callable, FunctionType):
         return callable, callable, False
-    if inspect.ismethod(callable):
+    if isinstance(callable, MethodType):
         return callable, callable, True
-    if inspect.isclass(callable):
+    if isinstance(callable, type):
         return get_class_init(callable), callable, True
     try:
         callable = getattr(callable, "__call__")
@@ -106,3 +109,15 @@ def get_class_init(class_):
     if func is WRAPPER_DESCRIPTOR:
         return fake_empty_init
     return func
+
+
+def is_coroutine_function(func):
+    """Check whether calling a function returns a coroutine.
+
+    This looks through wrappers that have a ``__wrapped__`` attribute,
+    such as dispatch functions.
+    """
+    # inspect is slow to import, so only do so when we actually need it.
+    import inspect
+
+    return inspect.iscoroutinefunction(inspect.unwrap(func))
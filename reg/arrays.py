@@ -0,0 +1,95 @@
+"""Dispatch over NumPy arrays of arguments.
+
+This module requires NumPy, so it is only imported when
+:meth:`reg.Dispatch.map_arrays` is used.
+"""
+
+from itertools import count
+
+import numpy as np
+
+
+def map_arrays(dispatch, names, arrays):
+    """Call a dispatch function for each row of arrays of arguments.
+
+    The predicate keys are computed a column at a time and grouped
+    using NumPy, the implementation is looked up once for each
+    distinct key and then called for all rows with that key.
+
+    :param dispatch: the :class:`reg.Dispatch`.
+    :param names: the names of the arguments of the dispatch function.
+    :param arrays: a sequence with for each argument an array of values.
+    :returns: an object array with the results, in row order.
+    """
+    if len(arrays) != len(names) or not arrays:
+        raise TypeError(
+            f"Expected an array for each of the arguments {names!r}, "
+            f"got {len(arrays)} arrays"
+        )
+    arrays = [as_object_array(array) for array in arrays]
+    length = len(arrays[0])
+    if any(len(array) != length for array in arrays):
+        raise ValueError("All arrays must have the same length")
+    columns = dict(zip(names, arrays))
+    key_columns = [
+        key_column(predicate, names, columns) for predicate in dispatch.predicates
+    ]
+    firsts, inverse, counts = np.unique(
+        combine([factorize(column, length) for column in key_columns], length),
+        return_index=True,
+        return_inverse=True,
+        return_counts=True,
+    )[1:]
+    order = np.argsort(inverse.reshape(-1), kind="stable")
+    groups = np.split(order, np.cumsum(counts)[:-1])
+
+    results = np.empty(length, dtype=object)
+    for first, rows in zip(firsts, groups):
+        implementation = dispatch._resolve(
+            tuple([column[first] for column in key_columns])
+        )
+        results[rows] = np.fromiter(
+            map(implementation, *[array[rows] for array in arrays]),
+            dtype=object,
+            count=len(rows),
+        )
+    return results
+
+
+def as_object_array(values):
+    if isinstance(values, np.ndarray):
+        if values.ndim != 1:
+            raise ValueError("Arrays of arguments must be one-dimensional")
+        return values.astype(object, copy=False)
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def key_column(predicate, names, columns):
+    """The list of keys of a predicate for all rows."""
+    if predicate.get_keys is not None:
+        return list(predicate.get_keys(columns))
+    get_key = predicate.get_key
+    return [get_key(dict(zip(names, row))) for row in zip(*columns.values())]
+
+
+def factorize(keys, length):
+    """An array with an integer code for each key.
+
+    Equal keys get equal codes, different keys different codes. The
+    codes are numbered from 0 up to the amount of distinct keys.
+    """
+    codes = {}
+    return densify(np.fromiter(map(codes.setdefault, keys, count()), np.int64, length))
+
+
+def combine(code_arrays, length):
+    """Combine arrays of codes into an array of codes for their rows."""
+    result = np.zeros(length, dtype=np.int64)
+    for codes in code_arrays:
+        # all codes are smaller than length, so this cannot overflow
+        result = densify(result * length + codes)
+    return result
+
+
+def densify(codes):
+    return np.unique(codes, return_inverse=True)[1].reshape(-1)
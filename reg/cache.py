@@ -1,8 +1,68 @@
-from repoze.lru import lru_cache
+from threading import Event, Lock, local
+
+# Guards the bookkeeping of flights in progress. It is only held
+# briefly, never while a value is computed.
+_flight_lock = Lock()
+
+
+class Flight:
+    """A computation in progress that other threads can wait for."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
 
 
 class Cache(dict):
-    """A dict to cache a function."""
+    """A dict to cache a function.
+
+    When several threads miss the same key at the same time, only the
+    first one calls the function; the others wait for its result.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.flights = {}
+
+    def __missing__(self, key):
+        with _flight_lock:
+            if key in self:
+                # stored while we were waiting for the lock
+                return dict.__getitem__(self, key)
+            flight = self.flights.get(key)
+            if flight is not None:
+                leader = False
+            else:
+                leader = True
+                flight = self.flights[key] = Flight()
+        if not leader:
+            return flight.wait()
+        try:
+            flight.result = self[key] = self.func(key)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with _flight_lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+
+class LocalCache(dict):
+    """A dict to cache a function, used by a single thread.
+
+    It cannot be missed by several threads at the same time, so unlike
+    :class:`Cache` it takes no lock.
+    """
 
     def __init__(self, func):
         self.func = func
@@ -12,6 +72,54 @@ class Cache(dict):
         return result
 
 
+_marker = object()
+
+
+def single_flight(func, cache=None):
+    """Make concurrent calls of func with the same key share one call.
+
+    This is used to wrap functions that are cached by a
+    :func:`repoze.lru.lru_cache` decorator, so that when several threads
+    miss the same key at the same time, only one of them calls func.
+
+    :param func: a function that takes a single key argument.
+    :param cache: the :class:`repoze.lru.LRUCache` used by the
+      decorator. The result is stored in it before waiting threads are
+      released, so that threads that come later find it there.
+    """
+    flights = {}
+
+    def call(key):
+        with _flight_lock:
+            if cache is not None:
+                # stored while we were waiting for the lock
+                result = cache.get((key,), _marker)
+                if result is not _marker:
+                    return result
+            flight = flights.get(key)
+            if flight is not None:
+                leader = False
+            else:
+                leader = True
+                flight = flights[key] = Flight()
+        if not leader:
+            return flight.wait()
+        try:
+            flight.result = func(key)
+            if cache is not None:
+                cache.put((key,), flight.result)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with _flight_lock:
+                del flights[key]
+            flight.done.set()
+        return flight.result
+
+    return call
+
+
 class DictCachingKeyLookup:
     """A key lookup that caches.
 
@@ -28,6 +136,10 @@ class DictCachingKeyLookup:
 
     """
 
+    # dispatch functions keep more of what they look up if the key
+    # lookup caches without bounds anyway
+    caches_unbounded = True
+
     def __init__(self, key_lookup):
         self.key_lookup = key_lookup
         self.component = Cache(key_lookup.component).__getitem__
@@ -62,7 +174,58 @@ class LruCachingKeyLookup:
         all_cache_size,
         fallback_cache_size,
     ):
+        # repoze.lru is only imported when an LRU cache is actually used.
+        from repoze.lru import LRUCache, lru_cache
+
+        def cached(size, func):
+            cache = LRUCache(size)
+            return lru_cache(size, cache)(single_flight(func, cache))
+
+        self.key_lookup = key_lookup
+        self.component = cached(component_cache_size, key_lookup.component)
+        self.fallback = cached(fallback_cache_size, key_lookup.fallback)
+        self.all = cached(all_cache_size, lambda key: list(key_lookup.all(key)))
+
+
+def thread_local_cache(func):
+    """Cache a function in a separate dict for each thread."""
+    caches = local()
+
+    def lookup(key):
+        try:
+            cache = caches.cache
+        except AttributeError:
+            cache = caches.cache = LocalCache(func)
+        return cache[key]
+
+    return lookup
+
+
+class ThreadLocalCachingKeyLookup:
+    """A key lookup that caches for each thread separately.
+
+    Implements the read-only API of :class:`reg.PredicateRegistry`, using
+    a cache to speed up access.
+
+    Each thread fills its own caches, which are backed by the registry
+    that is shared between all threads. Threads therefore never
+    contend on a shared cache, which lets dispatch scale with the
+    number of cores on a free-threaded (no-GIL) Python. The price is
+    a slightly slower cache hit and a separate cache for each thread,
+    so on a Python with a GIL you typically want
+    :class:`reg.DictCachingKeyLookup` instead.
+
+    :param: key_lookup - the :class:`PredicateRegistry` to cache.
+
+    """
+
+    caches_unbounded = True
+    # so that dispatch functions don't keep what they look up where
+    # all threads share it
+    caches_per_thread = True
+
+    def __init__(self, key_lookup):
         self.key_lookup = key_lookup
-        self.component = lru_cache(component_cache_size)(key_lookup.component)
-        self.fallback = lru_cache(fallback_cache_size)(key_lookup.fallback)
-        self.all = lru_cache(all_cache_size)(lambda key: list(key_lookup.all(key)))
+        self.component = thread_local_cache(key_lookup.component)
+        self.fallback = thread_local_cache(key_lookup.fallback)
+        self.all = thread_local_cache(lambda key: list(key_lookup.all(key)))
@@ -1,7 +1,8 @@
-import inspect
-from types import MethodType
+from functools import update_wrapper
+from types import FunctionType, MethodType
 from .dispatch import dispatch, Dispatch, format_signature, execute
-from .arginfo import arginfo
+from .arginfo import arginfo, is_coroutine_function
+from .error import RegistrationError
 
 
 class dispatch_method(dispatch):
@@ -22,21 +23,46 @@ class dispatch_method(dispatch):
       you can return a caching key lookup (such as
       :class:`reg.DictCachingKeyLookup` or
       :class:`reg.LruCachingKeyLookup`) to make it more efficient.
+    :param lazy: if true, compute the keys of the predicates in order,
+      and only as long as an implementation can still match.
     :param first_invocation_hook: a callable that accepts an instance of the
       class in which this decorator is used. It is invoked the first
-      time the method is invoked.
+      time the method is invoked. If it is a coroutine function, it is
+      awaited the first time the method is awaited.
 
     """
 
     def __init__(self, *predicates, **kw):
-        self.first_invocation_hook = kw.pop("first_invocation_hook", lambda x: None)
+        self.first_invocation_hook = kw.pop("first_invocation_hook", None)
+        if self.first_invocation_hook is None:
+            self.first_invocation_hook = lambda x: None
+            self._async_hook = False
+        else:
+            self._async_hook = is_coroutine_function(self.first_invocation_hook)
         super().__init__(*predicates, **kw)
         self._cache = {}
 
     def __call__(self, callable):
+        if self._async_hook and not is_coroutine_function(callable):
+            raise RegistrationError(
+                "Cannot await first invocation hook %r for non-asynchronous "
+                "dispatch method %r" % (self.first_invocation_hook, callable)
+            )
         self.callable = callable
+        self.owner = None
+        self.name = callable.__name__
         return self
 
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __reduce__(self):
+        # pickle by reference to the class that defines us
+        if self.owner is None:
+            raise TypeError(f"Cannot pickle {self!r} outside of a class")
+        return getattr_from_dict, (self.owner, self.name)
+
     def __get__(self, obj, type=None):
         # we get the method from the cache
         # this guarantees that we distinguish between dispatches
@@ -48,8 +74,12 @@ class dispatch_method(dispatch):
             # if this is the first time we access the dispatch method,
             # we create it and store it in the cache
             dispatch = DispatchMethod(
-                self.predicates, self.callable, self.get_key_lookup
+                self.predicates, self.callable, self.get_key_lookup, self.lazy
             ).call
+            if type is not None:
+                # so that it can be pickled by reference to its class
+                dispatch.__module__ = type.__module__
+                dispatch.__qualname__ = f"{type.__qualname__}.{self.name}"
             self._cache[type] = dispatch
 
         # we cannot attach the dispatch method to the class
@@ -60,10 +90,18 @@ class dispatch_method(dispatch):
             # we access it through the class directly, so unbound
             return dispatch
 
-        self.first_invocation_hook(obj)
-
         # if we access the instance, we simulate binding it
         bound = MethodType(dispatch, obj)
+
+        if self._async_hook:
+            # we cannot await the hook here, so we do so when the
+            # method is first invoked
+            bound = await_first_invocation_hook(
+                self.first_invocation_hook, obj, bound, self.callable.__name__
+            )
+        else:
+            self.first_invocation_hook(obj)
+
         # we store it on the instance, so that next time we
         # access this, we do not hit the descriptor anymore
         # but return the bound dispatch function directly
@@ -71,6 +109,42 @@ class dispatch_method(dispatch):
         return bound
 
 
+def await_first_invocation_hook(hook, obj, bound, name):
+    """Wrap a bound dispatch method so that it first awaits a hook.
+
+    The hook is awaited only once, even if the method is invoked again
+    while it runs. After that, the bound dispatch method replaces the
+    wrapper on ``obj``, so that later invocations don't go through it.
+    Until then, the wrapper has the attributes of the bound dispatch
+    method.
+    """
+    hooked = None
+
+    async def first_invocation(*args, **kw):
+        nonlocal hooked
+        if hooked is None:
+            import asyncio
+
+            hooked = asyncio.ensure_future(hook(obj))
+        try:
+            await hooked
+        except BaseException:
+            # try again on the next invocation, like a hook that
+            # fails when the method is accessed
+            hooked = None
+            raise
+        setattr(obj, name, bound)
+        return await bound(*args, **kw)
+
+    # so that it has the attributes of the bound dispatch method, such
+    # as register and by_args, before it is first invoked
+    return update_wrapper(first_invocation, bound)
+
+
+def getattr_from_dict(owner, name):
+    return vars(owner)[name]
+
+
 class DispatchMethod(Dispatch):
     def by_args(self, *args, **kw):
         """Lookup an implementation by invocation arguments.
@@ -81,6 +155,26 @@ class DispatchMethod(Dispatch):
         """
         return super().by_args(None, *args, **kw)
 
+    def resolve(self, *args, **kw):
+        """Find the implementation that is called for arguments.
+
+        :param args: positional arguments used in invocation.
+        :param kw: named arguments used in invocation.
+        :returns: the implementation, which takes the instance as its
+          first argument.
+        """
+        return super().resolve(None, *args, **kw)
+
+    def by_args_many(self, iterable_of_args):
+        """Lookup implementations for many invocation arguments.
+
+        :param iterable_of_args: an iterable of tuples with the
+          positional arguments used in invocation.
+        :returns: a list with a :class:`reg.LookupEntry` for each tuple
+          of arguments.
+        """
+        return super().by_args_many((None, *args) for args in iterable_of_args)
+
 
 def methodify(func, selfname=None):
     """Turn a function into a method, if needed.
@@ -99,6 +193,8 @@ def methodify(func, selfname=None):
     In all cases, :func:`inspect_methodified` lets you retrieve the wrapped
     function.
 
+    If ``func`` is a coroutine function, so is the wrapper.
+
     :param func: the function to turn into method.
 
     :param selfname: if specified, the name of the argument
@@ -116,12 +212,14 @@ def methodify(func, selfname=None):
         code_template = (
             "def wrapper({selfname}, {signature}): return _func({signature})"
         )
-    elif inspect.ismethod(func):
+    elif isinstance(func, MethodType):
         # Bound method: must be wrapped despite same signature:
         code_template = "def wrapper({signature}): return _func({signature})"
     else:
         # No wrapping needed:
         return func
+    if is_coroutine_function(func):
+        code_template = "async " + code_template.replace("return", "return await")
     code_source = code_template.format(
         signature=format_signature(args), selfname=selfname or "_"
     )
@@ -138,5 +236,5 @@ def clean_dispatch_methods(cls):
     """
     for name in dir(cls):
         attr = getattr(cls, name)
-        if inspect.isfunction(attr) and hasattr(attr, "clean"):
+        if isinstance(attr, FunctionType) and hasattr(attr, "clean"):
             attr.clean()
@@ -1,8 +1,12 @@
+import gc
+from abc import get_cache_token
+import os
 from functools import partial, wraps
 from collections import namedtuple
+from weakref import WeakSet
 from .predicate import match_instance
 from .predicate import PredicateRegistry
-from .arginfo import arginfo
+from .arginfo import arginfo, is_coroutine_function
 from .error import RegistrationError
 
 
@@ -24,14 +28,21 @@ class dispatch:
       you can return a caching key lookup (such as
       :class:`reg.DictCachingKeyLookup` or
       :class:`reg.LruCachingKeyLookup`) to make it more efficient.
-    :returns: a function that you can use as if it were a
-      :class:`reg.Dispatch` instance.
+    :param lazy: if true, compute the keys of the predicates in order,
+      and only as long as an implementation can still match. This
+      avoids computing the keys of the remaining predicates when one
+      of them has no registrations for its key.
+    :returns: a dispatch function. Its ``dispatch`` attribute is its
+      :class:`reg.Dispatch` instance, whose methods ``register``,
+      ``by_args``, ``by_predicates``, ``clean`` and ``add_predicates``
+      are also attributes of the dispatch function itself.
 
     """
 
     def __init__(self, *predicates, **kw):
         self.predicates = [self._make_predicate(predicate) for predicate in predicates]
         self.get_key_lookup = kw.pop("get_key_lookup", identity)
+        self.lazy = kw.pop("lazy", False)
 
     def _make_predicate(self, predicate):
         if isinstance(predicate, str):
@@ -39,37 +50,116 @@ class dispatch:
         return predicate
 
     def __call__(self, callable):
-        return Dispatch(self.predicates, callable, self.get_key_lookup).call
+        return Dispatch(self.predicates, callable, self.get_key_lookup, self.lazy).call
+
+
+# The methods of Dispatch that are also attributes of dispatch functions.
+_call_methods = ("add_predicates", "by_args", "by_predicates", "clean", "register")
 
 
 def identity(registry):
     return registry
 
 
+class cached_property:
+    """Property that is computed once and then stored on the instance.
+
+    Like :func:`functools.cached_property`, which needs Python 3.8.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+
 class LookupEntry(namedtuple("LookupEntry", "lookup key")):
-    """The dispatch data associated to a key."""
+    """The dispatch data associated to a key.
 
-    __slots__ = ()
+    Each entry computes its implementations only once. If its key
+    lookup caches without bounds, a dispatch function returns the same
+    entry for the same key until an implementation is registered.
+    """
 
-    @property
+    @cached_property
     def component(self):
         """The function to dispatch to, excluding fallbacks."""
         return self.lookup.component(self.key)
 
-    @property
+    @cached_property
     def fallback(self):
         """The approriate fallback implementation."""
         return self.lookup.fallback(self.key)
 
+    @cached_property
+    def _all_matches(self):
+        return tuple(self.lookup.all(self.key))
+
     @property
     def matches(self):
         """An iterator over all the compatible implementations."""
-        return self.lookup.all(self.key)
+        return iter(self._all_matches)
 
     @property
     def all_matches(self):
         """The list of all compatible implementations."""
-        return list(self.matches)
+        return list(self._all_matches)
+
+
+class LookupEntries(dict):
+    """The lookup entries of a key lookup, by key.
+
+    A dispatch function makes a new one when it replaces its key lookup
+    on registration, so that entries never outlive the registrations
+    they were computed for.
+    """
+
+    __slots__ = ("key_lookup",)
+
+    def __init__(self, key_lookup):
+        self.key_lookup = key_lookup
+
+    def __missing__(self, key):
+        return self.setdefault(key, LookupEntry(self.key_lookup, key))
+
+
+def interns_entries(key_lookup):
+    """Whether a dispatch function interns the entries of a key lookup.
+
+    Interned entries are kept until an implementation is registered, so
+    this is only done for key lookups that cache without bounds anyway,
+    which have a true ``caches_unbounded`` attribute.
+    """
+    return getattr(key_lookup, "caches_unbounded", False)
+
+
+class ClassImplementations(dict):
+    """The implementations of a dispatch function, by class mro.
+
+    This is used by dispatch functions with a single predicate on the
+    class of an argument. The implementation for a class, fallbacks
+    applied, is resolved when the class is first looked up. It is
+    looked up by the ``__mro__`` of the class, so that it is resolved
+    again when the bases of the class are reassigned.
+    """
+
+    __slots__ = ("resolve",)
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+
+    def __missing__(self, mro):
+        return self.setdefault(mro, self.resolve(mro[:1]))
+
+    def __call__(self, key):
+        # Look up the implementation for a key, like the component
+        # lookup of a key lookup, but with fallbacks applied.
+        return self[key[0].__mro__]
 
 
 class Dispatch:
@@ -90,79 +180,203 @@ class Dispatch:
       you can return a caching key lookup (such as
       :class:`reg.DictCachingKeyLookup` or
       :class:`reg.LruCachingKeyLookup`) to make it more efficient.
+    :param lazy: if true, compute the keys of the predicates lazily; see
+      :class:`reg.predicate.PredicateRegistry`.
+
+    If ``callable`` is a coroutine function, the dispatch function is
+    asynchronous: implementations and predicate fallbacks must then be
+    coroutine functions too. The dispatch function returns the
+    coroutine of the implementation it dispatches to, so awaiting it
+    costs the same as awaiting the implementation directly.
     """
 
-    def __init__(self, predicates, callable, get_key_lookup):
+    def __init__(self, predicates, callable, get_key_lookup, lazy=False):
         self.wrapped_func = callable
         self.get_key_lookup = get_key_lookup
+        self.lazy = lazy
+        self.is_async = is_coroutine_function(callable)
         self._original_predicates = predicates
         self._define_call()
         self._register_predicates(predicates)
+        _dispatches.add(self)
 
     def _register_predicates(self, predicates):
-        self.registry = PredicateRegistry(*predicates)
+        if self.is_async:
+            for predicate in predicates:
+                if predicate.fallback is not None:
+                    self._validate_coroutine_function(predicate.fallback)
+        registry = PredicateRegistry(*predicates, lazy=self.lazy)
+        if registry.is_async and not self.is_async:
+            raise RegistrationError(
+                "Cannot use asynchronous predicates for non-asynchronous "
+                "dispatch %r" % self.wrapped_func
+            )
+        self.registry = registry
         self.predicates = predicates
-        self.call.key_lookup = self.key_lookup = self.get_key_lookup(self.registry)
-        self.call.__globals__.update(
-            _registry_key=self.registry.key,
-            _component_lookup=self.key_lookup.component,
-            _fallback_lookup=self.key_lookup.fallback,
-        )
-        self._predicate_key.__globals__.update(
-            _registry_key=self.registry.key,
-            _return_type=partial(LookupEntry, self.key_lookup),
-        )
+        self._publish_key_lookup()
+
+    def _publish_key_lookup(self):
+        registry = self.registry
+        generation = registry.generation
+        abc_token = get_cache_token() if registry.uses_abcs() else None
+        key_lookup = self.get_key_lookup(registry)
+        self.call.key_lookup = self.key_lookup = key_lookup
+        cells = self._cells
+        if interns_entries(key_lookup):
+            self._entries = LookupEntries(key_lookup)
+            self._entry = self._entries.__getitem__
+        else:
+            self._entries = None
+            self._entry = partial(LookupEntry, key_lookup)
+        cells["_return_type"].cell_contents = self._entry
+        self._generation = generation
+        self._abc_token = abc_token
+        if abc_token is not None:
+            # ABCs can get virtual subclasses at any time, after which
+            # what the key lookup cached may no longer hold.
+            key = abc_checking_key(self._publish_key_lookup, registry.key, abc_token)
+        else:
+            key = registry.key
+        cells["_registry_key"].cell_contents = key
+        cells["_fallback_lookup"].cell_contents = key_lookup.fallback
+        component_lookup = key_lookup.component
+        fallback = self.wrapped_func
+        # Awaiting the key of asynchronous predicates takes a different
+        # call function, which we get by replacing its code. Without
+        # predicates, there can only be one implementation, so call
+        # calls it directly, as its fallback. With a single predicate
+        # on the class of an argument, call looks up the implementation
+        # by class, like singledispatch.
+        predicate_key = self._codes[1]
+        self._class_implementations = None
+        if registry.is_async:
+            call, predicate_key = self._codes[3:5]
+        elif not self.predicates:
+            call = self._codes[5]
+            fallback = self._resolve(())
+        else:
+            argument = self._class_argument()
+            if argument is None:
+                call = self._codes[0]
+            else:
+                call = make_class_call_code(self._signature, argument)
+                component_lookup = ClassImplementations(self._resolve)
+                self._class_implementations = component_lookup
+        cells["_fallback"].cell_contents = fallback
+        # Class implementations can also stand in for the component
+        # lookup of call, so we always replace the code while they are
+        # in place.
+        if isinstance(component_lookup, ClassImplementations):
+            cells["_component_lookup"].cell_contents = component_lookup
+            self.call.__code__ = call
+        else:
+            self.call.__code__ = call
+            cells["_component_lookup"].cell_contents = component_lookup
+        self._predicate_key.__code__ = predicate_key
+        if registry.generation != generation:
+            # registered while we published, which may have gone unnoticed
+            self._invalidate_key_lookup()
+
+    def _invalidate_key_lookup(self):
+        # What the key lookup cached may no longer hold after a
+        # registration. Rather than publish a new key lookup for each
+        # registration, the dispatch function publishes one when it is
+        # used again: the key function then publishes it, and call
+        # always uses the key function until then.
+        registry = self.registry
+
+        def publishing_key(**kw):
+            self._publish_key_lookup()
+            return registry.key(**kw)
+
+        self._cells["_registry_key"].cell_contents = publishing_key
+        self.call.__code__ = self._codes[3 if registry.is_async else 0]
+
+    def _refresh_key_lookup(self):
+        # Publishes the key lookup if it was invalidated or an ABC got
+        # a new virtual subclass, for the methods that look up
+        # implementations without the key function.
+        abc_token = self._abc_token
+        if self._generation != self.registry.generation or (
+            abc_token is not None and get_cache_token() != abc_token
+        ):
+            self._publish_key_lookup()
+
+    def _class_argument(self):
+        # The argument of which the class is the key of the only
+        # predicate, if any. Implementations can then be cached by
+        # class, if the key lookup caches without bounds anyway, in
+        # caches that all threads share.
+        if len(self.predicates) != 1 or self.registry.uses_abcs():
+            return None
+        key_lookup = self.key_lookup
+        if not getattr(key_lookup, "caches_unbounded", False) or getattr(
+            key_lookup, "caches_per_thread", False
+        ):
+            return None
+        argument = self.predicates[0].class_of
+        if argument not in arginfo(self.wrapped_func).args:
+            return None
+        return argument
+
+    def __reduce__(self):
+        # The call function is pickled by reference, so the dispatch
+        # function is restored by importing the module that defines it.
+        return dispatch_of, (self.call,)
+
+    def _prepare_for_fork(self):
+        self.registry.compact()
+        self._refresh_key_lookup()
+        key_lookup = self.key_lookup
+        if key_lookup is self.registry:
+            # nothing is cached, so there is nothing to warm up
+            return
+        registry = self.registry
+        for key in registry.known_keys:
+            # A registered key is not necessarily one that calls can
+            # produce, such as a default of None for a class predicate.
+            if not registry.accepts(key):
+                continue
+            key_lookup.component(key)
+            key_lookup.fallback(key)
+            key_lookup.all(key)
+            if self._class_implementations is not None:
+                self._class_implementations(key)
 
     def _define_call(self):
         # We build the generic function on the fly. Its definition
         # requires the signature of the wrapped function and the
         # arguments needed by the registered predicates
-        # (predicate_args):
-        code_template = """\
-def call({signature}):
-    _key = _registry_key({predicate_args})
-    return (_component_lookup(_key) or
-            _fallback_lookup(_key) or
-            _fallback)({signature})
-"""
-
+        # (predicate_args). The code is compiled only once per
+        # signature; each dispatch function gets its own closure
+        # cells, which we rebind when the predicates change.
         args = arginfo(self.wrapped_func)
         signature = format_signature(args)
         predicate_args = ", ".join("{0}={0}".format(x) for x in args.args)
-        code_source = code_template.format(
-            signature=signature, predicate_args=predicate_args
+        functions = make_call_factory(signature, predicate_args)(
+            None, None, None, self.wrapped_func, None
         )
-
-        # We now compile call to byte-code:
-        self.call = call = wraps(self.wrapped_func)(
-            execute(
-                code_source,
-                _registry_key=None,
-                _component_lookup=None,
-                _fallback_lookup=None,
-                _fallback=self.wrapped_func,
-            )["call"]
-        )
-
-        # We copy over the defaults from the wrapped function.
-        call.__defaults__ = args.defaults
-
-        # Make the methods available as attributes of call
-        for k in dir(type(self)):
-            if not k.startswith("_"):
-                setattr(call, k, getattr(self, k))
+        self._cells = cells = {}
+        for func in functions:
+            cells.update(zip(func.__code__.co_freevars, func.__closure__))
+            # We copy over the defaults from the wrapped function.
+            func.__defaults__ = args.defaults
+        call, self._predicate_key, self._key = functions[:3]
+        self._codes = tuple(func.__code__ for func in functions)
+        self._signature = signature
+        self.call = call = wraps(self.wrapped_func)(call)
+        if self.is_async:
+            mark_coroutine_function(call)
+
+        # Make the dispatch and the methods dispatch functions always
+        # had available as attributes of call. Other methods are only
+        # available through the dispatch, so that they don't each add a
+        # bound method to every dispatch function.
+        call.dispatch = self
+        for k in _call_methods:
+            setattr(call, k, getattr(self, k))
         call.wrapped_func = self.wrapped_func
 
-        # We now build the implementation for the predicate_key method
-        self._predicate_key = execute(
-            "def predicate_key({signature}):\n"
-            "    return _return_type(_registry_key({predicate_args}))".format(
-                signature=format_signature(args), predicate_args=predicate_args
-            ),
-            _registry_key=None,
-            _return_type=None,
-        )["predicate_key"]
-
     def clean(self):
         """Clean up implementations and added predicates.
 
@@ -203,16 +417,27 @@ def call({signature}):
         if func is None:
             return partial(self.register, **key_dict)
         validate_signature(func, self.wrapped_func)
+        if self.is_async:
+            self._validate_coroutine_function(func)
         predicate_key = self.registry.key_dict_to_predicate_key(key_dict)
         self.registry.register(predicate_key, func)
+        self._invalidate_key_lookup()
         return func
 
+    def _validate_coroutine_function(self, func):
+        if not is_coroutine_function(func):
+            raise RegistrationError(
+                "Cannot register non-coroutine function for asynchronous "
+                "dispatch %r: %r" % (self.wrapped_func, func)
+            )
+
     def by_args(self, *args, **kw):
         """Lookup an implementation by invocation arguments.
 
         :param args: positional arguments used in invocation.
         :param kw: named arguments used in invocation.
-        :returns: a :class:`reg.LookupEntry`.
+        :returns: a :class:`reg.LookupEntry`, or an awaitable of one if
+          some predicates are asynchronous.
         """
         return self._predicate_key(*args, **kw)
 
@@ -222,11 +447,328 @@ def call({signature}):
         :param predicate_values: the values of the predicates to lookup.
         :returns: a :class:`reg.LookupEntry`.
         """
-        return LookupEntry(
-            self.key_lookup,
-            self.registry.key_dict_to_predicate_key(predicate_values),
+        self._refresh_key_lookup()
+        return self._entry(self.registry.key_dict_to_predicate_key(predicate_values))
+
+    def resolve(self, *args, **kw):
+        """Find the implementation that is called for arguments.
+
+        The implementation is the one the dispatch function would call
+        with the arguments, with fallbacks applied. Call it directly to
+        avoid computing the key and looking up the implementation again,
+        for instance in a loop over arguments of the same types.
+
+        :param args: positional arguments used in invocation.
+        :param kw: named arguments used in invocation.
+        :returns: the implementation.
+        """
+        return self._resolve(self._synchronous_key()(*args, **kw))
+
+    def call_with_key(self, key, *args, **kw):
+        """Call the implementation for a key.
+
+        This calls the implementation the dispatch function would call
+        for arguments with the given predicate key, without computing
+        the key from the arguments.
+
+        :param key: a predicate key, such as the ``key`` of a
+          :class:`reg.LookupEntry`.
+        :param args: positional arguments for the implementation.
+        :param kw: named arguments for the implementation.
+        :returns: the result of the implementation.
+        """
+        return self._resolve(key)(*args, **kw)
+
+    def by_args_many(self, iterable_of_args):
+        """Lookup implementations for many invocation arguments.
+
+        This is like calling :meth:`reg.Dispatch.by_args` for each
+        tuple of arguments, but arguments with the same predicate key
+        share one lookup entry.
+
+        :param iterable_of_args: an iterable of tuples with the
+          positional arguments used in invocation.
+        :returns: a list with a :class:`reg.LookupEntry` for each tuple
+          of arguments.
+        """
+        key = self._synchronous_key()
+        return self._lookup_entries(key(*args) for args in iterable_of_args)
+
+    def by_predicates_many(self, iterable_of_predicate_values):
+        """Lookup implementations for many predicate values.
+
+        This is like calling :meth:`reg.Dispatch.by_predicates` for
+        each dictionary of predicate values, but predicate values that
+        result in the same key share one lookup entry.
+
+        :param iterable_of_predicate_values: an iterable of dictionaries
+          with the values of the predicates to lookup.
+        :returns: a list with a :class:`reg.LookupEntry` for each
+          dictionary of predicate values.
+        """
+        return self._lookup_entries(
+            map(self.registry.key_dict_to_predicate_key, iterable_of_predicate_values)
         )
 
+    def _lookup_entries(self, keys):
+        keys = list(keys)
+        self._refresh_key_lookup()
+        entries = self._entries
+        if entries is None:
+            # the same key still gets the same entry within a batch
+            entries = LookupEntries(self.key_lookup)
+        return [entries[key] for key in keys]
+
+    def map(self, iterable_of_args, executor=None, chunksize=None):
+        """Call the dispatch function for many arguments.
+
+        This looks up the implementation only once for each distinct
+        predicate key and groups the arguments by implementation. If
+        an executor is given, the groups are divided into batches that
+        are run by the executor.
+
+        :param iterable_of_args: an iterable of tuples with positional
+          arguments for the dispatch function.
+        :param executor: an optional
+          :class:`concurrent.futures.Executor`. If it is a process pool,
+          the implementations and arguments need to be picklable.
+        :param chunksize: the maximum amount of arguments in a batch.
+          By default, the arguments for an implementation are divided
+          into as many batches as there are CPUs.
+        :returns: a list of the results, in the order of
+          ``iterable_of_args``.
+        """
+        items = list(iterable_of_args)
+        implementation_for = self._implementation_getter()
+        results = [None] * len(items)
+        groups = {}
+        for index, args in enumerate(items):
+            implementation = implementation_for(args)
+            if executor is None:
+                results[index] = implementation(*args)
+            else:
+                groups.setdefault(implementation, []).append(index)
+        futures = []
+        for implementation, indexes in groups.items():
+            if implementation is self.wrapped_func:
+                # the wrapped function cannot be pickled by reference,
+                # so we pass the dispatch function that refers to it
+                function, implementation = call_wrapped_batch, self.call
+            else:
+                function = call_batch
+            size = chunksize or -(-len(indexes) // (os.cpu_count() or 1))
+            for start in range(0, len(indexes), size):
+                batch = indexes[start : start + size]
+                futures.append(
+                    (
+                        batch,
+                        executor.submit(
+                            function, implementation, [items[i] for i in batch]
+                        ),
+                    )
+                )
+        for batch, future in futures:
+            for index, result in zip(batch, future.result()):
+                results[index] = result
+        return results
+
+    def map_arrays(self, *arrays):
+        """Call the dispatch function for arrays of arguments.
+
+        This computes the predicate keys for all rows in bulk, looks up
+        the implementation once for each distinct key and then calls
+        it for the rows with that key. This is faster than calling the
+        dispatch function for each row, especially for predicates
+        created with :func:`reg.match_instance`, :func:`reg.match_key`
+        and :func:`reg.match_class` without a ``func``.
+
+        This requires NumPy.
+
+        :param arrays: for each positional argument of the dispatch
+          function, a one-dimensional array or sequence with a value for
+          each row.
+        :returns: a NumPy object array with the results, in row order.
+        """
+        from .arrays import map_arrays
+
+        self._synchronous_key()
+        return map_arrays(self, arginfo(self.wrapped_func).args, arrays)
+
+    def stream(self, iterable_of_args, cache_size=1000):
+        """Lazily call the dispatch function for a stream of arguments.
+
+        This consumes the arguments one at a time, so a stream of any
+        length is handled in constant memory. Implementations are looked
+        up once for each distinct predicate key; implementations that
+        are registered while the stream is consumed may therefore not
+        be used for it.
+
+        :param iterable_of_args: an iterable or an asynchronous iterable
+          of tuples with positional arguments for the dispatch function.
+        :param cache_size: the maximum amount of predicate keys for
+          which to remember the implementation.
+        :returns: a generator of the results or, if
+          ``iterable_of_args`` is an asynchronous iterable, an
+          asynchronous generator of the results.
+        """
+        implementation_for = self._implementation_getter(cache_size)
+        if hasattr(iterable_of_args, "__aiter__"):
+            return stream_async(iterable_of_args, implementation_for)
+        return stream(iterable_of_args, implementation_for)
+
+    def _implementation_getter(self, cache_size=None):
+        # Returns a function that gets the implementation for a tuple
+        # of arguments, remembering it for up to cache_size keys.
+        key = self._synchronous_key()
+        resolve = self._resolve
+        implementations = {}
+
+        def implementation_for(args):
+            k = key(*args)
+            try:
+                return implementations[k]
+            except KeyError:
+                pass
+            if cache_size is not None and len(implementations) >= cache_size:
+                implementations.clear()
+            implementation = implementations[k] = resolve(k)
+            return implementation
+
+        return implementation_for
+
+    def _synchronous_key(self):
+        # The key function, for methods that cannot await keys.
+        if self.registry.is_async:
+            raise TypeError(
+                f"Cannot compute the keys of asynchronous predicates of "
+                f"{self.wrapped_func!r} synchronously"
+            )
+        return self._key
+
+    def _resolve(self, key):
+        # The implementation that the dispatch function calls for key.
+        self._refresh_key_lookup()
+        key_lookup = self.key_lookup
+        return (
+            key_lookup.component(key) or key_lookup.fallback(key) or self.wrapped_func
+        )
+
+
+class DispatchGroup(dispatch):
+    """Group of dispatch functions with the same predicates.
+
+    This takes the same arguments as :class:`reg.dispatch`, except
+    ``lazy``. Use the group as a decorator to create its members,
+    which are dispatch functions with the predicates of the group and
+    the same signature. Implementations are registered on the members
+    as usual, but :meth:`reg.DispatchGroup.resolve` finds the
+    implementations of all members while computing the predicate key
+    only once. For this, all members must keep the predicates of the
+    group, so don't use :meth:`reg.Dispatch.add_predicates` on them.
+    """
+
+    def __init__(self, *predicates, **kw):
+        super().__init__(*predicates, **kw)
+        if self.lazy:
+            raise TypeError("The members of a dispatch group cannot be lazy")
+        self.members = []
+
+    def __call__(self, callable):
+        if self.members:
+            first = self.members[0].wrapped_func
+            if not same_signature(arginfo(first), arginfo(callable)):
+                raise RegistrationError(
+                    "Signature of %r not that of the other members of "
+                    "the dispatch group (%r)" % (callable, first)
+                )
+        member = Dispatch(self.predicates, callable, self.get_key_lookup)
+        self.members.append(member)
+        return member.call
+
+    def resolve(self, *args, **kw):
+        """Find the implementations of all members for arguments.
+
+        :param args: positional arguments used in invocation.
+        :param kw: named arguments used in invocation.
+        :returns: a tuple with for each member, in the order in which
+          they were added, the implementation it would call with the
+          arguments.
+        """
+        members = self.members
+        if not members:
+            return ()
+        key = members[0]._synchronous_key()(*args, **kw)
+        return tuple([member._resolve(key) for member in members])
+
+
+def abc_checking_key(publish_key_lookup, key, token):
+    """Wrap a key function to notice new virtual subclasses of ABCs.
+
+    When :func:`abc.get_cache_token` changes from ``token``, an ABC got
+    a new virtual subclass, so the key lookup is published anew before
+    the key is computed, dropping what it cached.
+    """
+
+    def checking_key(**kw):
+        if get_cache_token() != token:
+            publish_key_lookup()
+        return key(**kw)
+
+    return checking_key
+
+
+def stream(iterable_of_args, implementation_for):
+    for args in iterable_of_args:
+        yield implementation_for(args)(*args)
+
+
+async def stream_async(iterable_of_args, implementation_for):
+    async for args in iterable_of_args:
+        yield implementation_for(args)(*args)
+
+
+def call_batch(implementation, batch):
+    """Call implementation for each tuple of arguments in batch."""
+    return [implementation(*args) for args in batch]
+
+
+def call_wrapped_batch(call, batch):
+    """Call the function wrapped by a dispatch function for each batch item."""
+    return call_batch(call.wrapped_func, batch)
+
+
+def dispatch_of(call):
+    """Get the :class:`Dispatch` instance of a dispatch function."""
+    return call.dispatch
+
+
+# All dispatch functions that are alive, for prepare_for_fork.
+_dispatches = WeakSet()
+
+
+def prepare_for_fork(freeze=True):
+    """Prepare dispatch functions to be shared by forked worker processes.
+
+    Call this in the parent process of a pre-fork server once all
+    implementations are registered, just before forking the workers.
+    It fills the caches of all dispatch functions for their
+    registered predicate keys and compacts their registries, so that
+    workers do not each fill and grow their own copies.
+
+    Dispatch methods are only prepared for classes on which they have
+    been accessed already.
+
+    :param freeze: if true, finally collect garbage and move all
+      objects into the permanent generation using :func:`gc.freeze`, so
+      that garbage collection in the workers does not touch them, which
+      would unshare the memory pages they are in.
+    """
+    for dispatch in list(_dispatches):
+        dispatch._prepare_for_fork()
+    if freeze:
+        gc.collect()
+        gc.freeze()
+
 
 def validate_signature(f, dispatch):
     f_arginfo = arginfo(f)
@@ -241,6 +783,19 @@ def validate_signature(f, dispatch):
         )
 
 
+def mark_coroutine_function(func):
+    """Mark a function that returns a coroutine as a coroutine function.
+
+    This is only possible on Python 3.12 and later, where
+    :func:`inspect.iscoroutinefunction` recognizes the mark.
+    """
+    import inspect
+
+    mark = getattr(inspect, "markcoroutinefunction", None)
+    if mark is not None:  # pragma: no cover
+        mark(func)
+
+
 def format_signature(args):
     return ", ".join(
         args.args
@@ -260,6 +815,103 @@ def same_signature(a, b):
     return len(a_args) == len(b_args) and a.varargs == b.varargs and a.varkw == b.varkw
 
 
+_call_template = """\
+def factory(_registry_key, _component_lookup, _fallback_lookup,
+            _fallback, _return_type):
+    def call({signature}):
+        _key = _registry_key({predicate_args})
+        return (_component_lookup(_key) or
+                _fallback_lookup(_key) or
+                _fallback)({signature})
+
+    def predicate_key({signature}):
+        # computing the key can replace the key lookup, so we only
+        # get the entry after it
+        _key = _registry_key({predicate_args})
+        return _return_type(_key)
+
+    def key({signature}):
+        return _registry_key({predicate_args})
+
+    async def async_call({signature}):
+        _key = await _registry_key({predicate_args})
+        return await (_component_lookup(_key) or
+                      _fallback_lookup(_key) or
+                      _fallback)({signature})
+
+    async def async_predicate_key({signature}):
+        _key = await _registry_key({predicate_args})
+        return _return_type(_key)
+
+    def direct_call({signature}):
+        return _fallback({signature})
+        # never reached, but gives direct_call the same closure cells
+        # as call, so that its code can replace that of call
+        _registry_key, _component_lookup, _fallback_lookup
+
+    return (call, predicate_key, key, async_call, async_predicate_key,
+            direct_call)
+"""
+
+_call_factories = {}
+
+
+def make_call_factory(signature, predicate_args):
+    """Get a factory for the call, predicate_key and key functions.
+
+    The factory is compiled once for each distinct signature and
+    shared by all dispatch functions with that signature, so that
+    they also share code objects and globals.
+
+    The factory also returns variants of call and predicate_key that
+    await the key, for registries with asynchronous predicates, and a
+    variant of call for dispatch functions without predicates, which
+    calls the implementation directly. They use the same closure
+    cells, so their code can replace that of call and predicate_key.
+    """
+    try:
+        return _call_factories[signature, predicate_args]
+    except KeyError:
+        pass
+    factory = execute(
+        _call_template.format(signature=signature, predicate_args=predicate_args)
+    )["factory"]
+    _call_factories[signature, predicate_args] = factory
+    return factory
+
+
+_class_call_template = """\
+def factory(_registry_key, _component_lookup, _fallback_lookup, _fallback):
+    def class_call({signature}):
+        return _component_lookup[{argument}.__class__.__mro__]({signature})
+        # never reached, but gives class_call the same closure cells
+        # as call, so that its code can replace that of call
+        _registry_key, _fallback_lookup, _fallback
+
+    return class_call
+"""
+
+_class_call_codes = {}
+
+
+def make_class_call_code(signature, argument):
+    """Get the code of call that looks up implementations by class.
+
+    ``argument`` is the name of the argument whose class is used.
+    """
+    try:
+        return _class_call_codes[signature, argument]
+    except KeyError:
+        pass
+    factory = execute(
+        _class_call_template.format(signature=signature, argument=argument)
+    )["factory"]
+    code = _class_call_codes[signature, argument] = factory(
+        None, None, None, None
+    ).__code__
+    return code
+
+
 def execute(code_source, **namespace):
     """Execute code in a namespace, returning the namespace."""
     code_object = compile(code_source, f"<generated code: {code_source}>", "exec")
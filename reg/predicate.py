@@ -1,7 +1,12 @@
-import inspect
-from operator import itemgetter
+from abc import ABCMeta, get_cache_token
+from collections import namedtuple
+from contextvars import ContextVar
+from operator import attrgetter, itemgetter
 from itertools import product
+from threading import Lock
+from weakref import WeakKeyDictionary
 
+from .arginfo import arginfo, is_coroutine_function
 from .error import RegistrationError
 
 
@@ -15,22 +20,53 @@ class Predicate:
       or :class:`ClassIndex`.
     :param get_key: a callable that accepts a dictionary with the invocation
       arguments of the generic function and returns a key to be used for
-      dispatching.
+      dispatching. If it is a coroutine function, the key is awaited;
+      this is only possible for asynchronous dispatch functions.
     :param fallback: optional fallback value. The fallback of the
       the most generic index for which no values could be
       found is used.
     :param default: default expected value of the predicate, to be
       used by :meth:`reg.Dispatch.register` whenever the expected
       value for the predicate is not given explicitly.
+    :param get_keys: optional callable that accepts a dictionary with
+      sequences of invocation arguments of the generic function and
+      returns an iterable with the key for each of them. This is used
+      by :meth:`reg.Dispatch.map_arrays` to compute keys in bulk. If
+      ``None``, ``get_key`` is called for each invocation.
+    :param class_of: optional name of an argument of the generic
+      function, if ``get_key`` returns the class of that argument and
+      does nothing else. A dispatch function with only such a
+      predicate looks up implementations by class directly.
 
     """
 
-    def __init__(self, name, index, get_key=None, fallback=None, default=None):
+    __slots__ = (
+        "name",
+        "index",
+        "fallback",
+        "get_key",
+        "default",
+        "get_keys",
+        "class_of",
+    )
+
+    def __init__(
+        self,
+        name,
+        index,
+        get_key=None,
+        fallback=None,
+        default=None,
+        get_keys=None,
+        class_of=None,
+    ):
         self.name = name
         self.index = index
         self.fallback = fallback
         self.get_key = get_key
         self.default = default
+        self.get_keys = get_keys
+        self.class_of = class_of
 
     def create_index(self):
         return self.index(self.fallback)
@@ -39,74 +75,231 @@ class Predicate:
         return d.get(self.name, self.default)
 
 
-def match_key(name, func=None, fallback=None, default=None):
+def match_key(name, func=None, fallback=None, default=None, shared=False):
     """Predicate that returns a value used for dispatching.
 
     :name: predicate name.
     :func: a callable that accepts the same arguments as the generic
       function and returns the value used for dispatching.  The
-      returned value must be of an immutable type.
+      returned value must be of an immutable type. If it is a
+      coroutine function, the value is awaited.
 
       If ``None``, use a callable returning the argument
       with the same name as the predicate.
     :fallback: the fallback value. By default it is ``None``.
     :default: optional default value.
+    :shared: if true, ``func`` only takes the arguments of the generic
+      function that it needs, and within a :class:`reg.key_scope` its
+      result is computed once for the same arguments and shared by all
+      dispatch functions that use it.
     :returns: a :class:`Predicate`.
 
     """
     if func is None:
-        get_key = itemgetter(name)
+        get_key = get_keys = itemgetter(name)
+    elif shared:
+        get_key = shared_key(func)
+        get_keys = None
+    elif is_coroutine_function(func):
+
+        async def get_key(d):
+            return await func(**d)
+
+        get_keys = None
     else:
         get_key = lambda d: func(**d)
-    return Predicate(name, KeyIndex, get_key, fallback, default)
+        get_keys = None
+    return Predicate(name, KeyIndex, get_key, fallback, default, get_keys)
 
 
-def match_instance(name, func=None, fallback=None, default=None):
+def match_instance(name, func=None, fallback=None, default=None, shared=False):
     """Predicate that returns an instance whose class is used for dispatching.
 
     :name: predicate name.
 
     :func: a callable that accepts the same arguments as the generic
       function and returns the instance whose class is used for
-      dispatching.  If ``None``, use a callable returning the argument
+      dispatching.  If it is a coroutine function, the instance is
+      awaited. If ``None``, use a callable returning the argument
       with the same name as the predicate.
     :fallback: the fallback value. By default it is ``None``.
     :default: optional default value.
+    :shared: if true, ``func`` only takes the arguments of the generic
+      function that it needs, and within a :class:`reg.key_scope` its
+      result is computed once for the same arguments and shared by all
+      dispatch functions that use it.
     :returns: a :class:`Predicate`.
 
     """
+    class_of = None
     if func is None:
         get_key = lambda d: d[name].__class__
+        get_keys = lambda columns: map(_get_class, columns[name])
+        class_of = name
+    elif shared:
+        get_key = shared_key(func, _get_class)
+        get_keys = None
+    elif is_coroutine_function(func):
+
+        async def get_key(d):
+            return (await func(**d)).__class__
+
+        get_keys = None
     else:
         get_key = lambda d: func(**d).__class__
-    return Predicate(name, ClassIndex, get_key, fallback, default)
+        get_keys = None
+    return Predicate(name, ClassIndex, get_key, fallback, default, get_keys, class_of)
 
 
-def match_class(name, func=None, fallback=None, default=None):
+def match_class(name, func=None, fallback=None, default=None, shared=False):
     """Predicate that returns a class used for dispatching.
 
     :name: predicate name.
 
     :func: a callable that accepts the same arguments as the generic
       function and returns a class used for
-      dispatching.  If ``None``, use a callable returning the argument
+      dispatching.  If it is a coroutine function, the class is
+      awaited. If ``None``, use a callable returning the argument
       with the same name as the predicate.
     :fallback: the fallback value. By default it is ``None``.
     :default: optional default value.
+    :shared: if true, ``func`` only takes the arguments of the generic
+      function that it needs, and within a :class:`reg.key_scope` its
+      result is computed once for the same arguments and shared by all
+      dispatch functions that use it.
     :returns: a :class:`Predicate`.
 
     """
     if func is None:
-        get_key = itemgetter(name)
+        get_key = get_keys = itemgetter(name)
+    elif shared:
+        get_key = shared_key(func)
+        get_keys = None
+    elif is_coroutine_function(func):
+
+        async def get_key(d):
+            return await func(**d)
+
+        get_keys = None
     else:
         get_key = lambda d: func(**d)
-    return Predicate(name, ClassIndex, get_key, fallback, default)
+        get_keys = None
+    return Predicate(name, ClassIndex, get_key, fallback, default, get_keys)
+
+
+def match_protocol(name, func=None, fallback=None, default=None, shared=False):
+    """Predicate that dispatches on the protocols an instance conforms to.
+
+    This is like :func:`reg.match_instance`, but you can also register
+    implementations for :func:`typing.runtime_checkable` protocols.
+    Whether a class conforms to a protocol is checked once, when an
+    instance of it is first dispatched on. Protocols come after the
+    explicit base classes that conform to them, like abstract base
+    classes. As conformance is checked for classes, protocols with
+    data members are not supported.
+
+    :name: predicate name.
+    :func: a callable that accepts the same arguments as the generic
+      function and returns the instance whose class is used for
+      dispatching. If ``None``, use a callable returning the argument
+      with the same name as the predicate.
+    :fallback: the fallback value. By default it is ``None``.
+    :default: optional default value.
+    :shared: see :func:`reg.match_instance`.
+    :returns: a :class:`Predicate`.
+
+    """
+    predicate = match_instance(name, func, fallback, default, shared)
+    predicate.index = ProtocolIndex
+    return predicate
+
+
+_get_class = attrgetter("__class__")
+
+# The memo of shared keys in the current key scope, if any.
+_key_memo = ContextVar("reg.key_memo", default=None)
+
+
+class key_scope:
+    """Context manager in which shared predicate keys are memoized.
+
+    Within the scope, the key function of a predicate created with
+    ``shared=True`` is called only once for the same argument objects,
+    even by different dispatch functions. Use this for the duration of
+    a web request, for instance, so that predicates that derive the
+    same values from the request compute them only once. A scope
+    applies to the current thread or asynchronous task, including tasks
+    started from it. Scopes can be nested; a nested scope starts with
+    an empty memo.
+    """
+
+    def __enter__(self):
+        self._token = _key_memo.set({})
+        return self
+
+    def __exit__(self, *exc_info):
+        _key_memo.reset(self._token)
+
+
+def shared_key(func, convert=None):
+    """Make the key function of a shared predicate.
+
+    ``func`` is called with the arguments it names. Within a
+    :class:`key_scope`, its result is memoized by ``func`` and the
+    identity of those arguments. The arguments are kept with the
+    result, so that their identity is not reused during the scope.
+    ``convert`` is applied to the result, if given.
+    """
+    names = arginfo(func).args
+
+    if is_coroutine_function(func):
+
+        async def get_key(d):
+            args = tuple([d[name] for name in names])
+            memo = _key_memo.get()
+            if memo is None:
+                result = await func(*args)
+            else:
+                memo_key = (func, *map(id, args))
+                try:
+                    future = memo[memo_key][0]
+                except KeyError:
+                    import asyncio
+
+                    # a task can be awaited by all that need the key
+                    future = asyncio.ensure_future(func(*args))
+                    memo[memo_key] = future, args
+                result = await future
+            return result if convert is None else convert(result)
+
+        return get_key
+
+    def get_key(d):
+        args = tuple([d[name] for name in names])
+        memo = _key_memo.get()
+        if memo is None:
+            result = func(*args)
+        else:
+            memo_key = (func, *map(id, args))
+            try:
+                result = memo[memo_key][0]
+            except KeyError:
+                result = func(*args)
+                memo[memo_key] = result, args
+        return result if convert is None else convert(result)
+
+    return get_key
 
 
 _emptyset = frozenset()
 
 
 class KeyIndex(dict):
+    __slots__ = ("fallback",)
+
+    # the keys are not classes, so none are abstract base classes
+    abcs = ()
+
     def __init__(self, fallback=None):
         self.fallback = fallback
 
@@ -118,31 +311,289 @@ class KeyIndex(dict):
 
         There is only a single permutation: the key itself.
         """
-        yield key
+        return (key,)
+
+    def candidates(self, key):
+        """The permutations of key that have registrations, in order."""
+        if type(self).permutations is KeyIndex.permutations:
+            # the key is its only permutation
+            return (key,) if key in self else ()
+        return tuple([k for k in self.permutations(key) if k in self])
+
+    def matches(self, key):
+        """Whether any permutation of key has registrations."""
+        return bool(self.candidates(key))
+
+    def accepts(self, key):
+        """Whether key can be looked up.
+
+        Any key can be looked up in a simple index.
+        """
+        return True
 
 
 class ClassIndex(KeyIndex):
+    __slots__ = ("_abcs", "_candidates")
+
+    def __init__(self, fallback=None):
+        super().__init__(fallback)
+        self._abcs = None
+        # created by the first lookup, as many indexes never have one,
+        # such as those that registrations are made in
+        self._candidates = None
+
+    @property
+    def abcs(self):
+        """The registered classes that are abstract base classes."""
+        abcs = self._abcs
+        if abcs is None:
+            abcs = self._abcs = tuple([k for k in self if isinstance(k, ABCMeta)])
+        return abcs
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        # The candidates of classes can change, so we start over with
+        # new ones. Lookups that computed candidates before this store
+        # them in the ones they started with.
+        self._abcs = None
+        self._candidates = None
+
+    def update(self, *args, **kw):
+        super().update(*args, **kw)
+        self._abcs = None
+        self._candidates = None
+
     def permutations(self, key):
         """Permutations for class key.
 
-        Returns class and its base classes in mro order. If a classic
-        class in Python 2, smuggle in ``object`` as the base class
-        anyway to make lookups consistent.
+        Returns class and its base classes in mro order, which Python
+        keeps up to date in the ``__mro__`` of the class.
+
+        If abstract base classes are registered of which the class is
+        a virtual subclass, they are included in the order in which
+        :func:`functools.singledispatch` considers them.
+        """
+        abcs = self.abcs
+        if abcs:
+            return composed_mro(key, abcs)
+        return key.__mro__
+
+    def accepts(self, key):
+        """Whether key can be looked up.
+
+        Only classes can be looked up, though other keys can be
+        registered, such as a default of ``None``.
+        """
+        return isinstance(key, type)
+
+    def candidates(self, key):
+        """The classes in the permutations of key that have registrations.
+
+        These are computed once for each class, until a class is
+        added to the index, the mro of the class changes or, if
+        abstract base classes are registered, one of them gets a new
+        virtual subclass. They do not keep the class alive.
         """
-        for class_ in inspect.getmro(key):
-            yield class_
-        if class_ is not object:
-            yield object  # pragma: no cover
+        cache = self._candidates
+        if cache is None:
+            cache = self._candidates = WeakKeyDictionary()
+        # the class itself is not stored, so that the cache does not
+        # keep it alive
+        bases_mro = key.__mro__[1:]
+        token = get_cache_token() if self.abcs else None
+        entry = cache.get(key)
+        if entry is not None and entry[0] == bases_mro and entry[1] == token:
+            return entry[2]
+        candidates = tuple([k for k in self.permutations(key) if k in self])
+        cache[key] = (bases_mro, token, candidates)
+        return candidates
+
+
+# The mros including virtual bases, shared by all class indexes. An
+# entry goes away with its class.
+_mro_cache = WeakKeyDictionary()
+
+
+def composed_mro(class_, abcs):
+    """The mro of a class, including the abcs it is a virtual subclass of.
+
+    This is computed once per class and abcs, until an abstract base
+    class gets a new virtual subclass or the mro of the class changes
+    because bases were reassigned.
+    """
+    token = get_cache_token()
+    # the class itself is not stored, so that the cache does not keep
+    # it alive
+    bases_mro = class_.__mro__[1:]
+    entry = _mro_cache.get(class_)
+    if entry is None or entry[0] != token or entry[1] != bases_mro:
+        entry = _mro_cache[class_] = (token, bases_mro, {})
+    mros = entry[2]
+    try:
+        rest = mros[abcs]
+    except KeyError:
+        # This is private to functools, so we only import it when it
+        # is needed, rather than make importing reg depend on it.
+        from functools import _compose_mro
+
+        rest = mros[abcs] = tuple(_compose_mro(class_, abcs))[1:]
+    return (class_, *rest)
+
+
+class ProtocolIndex(ClassIndex):
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        # Protocols can only be used if conformance can be checked for
+        # a class, so we check this when they are registered.
+        try:
+            issubclass(object, key)
+        except TypeError as e:
+            raise RegistrationError(f"Cannot dispatch on {key!r}: {e}")
+        super().__setitem__(key, value)
+
+
+def async_key(key_getters):
+    """Make a key function for predicates of which some are asynchronous.
+
+    The key function is a coroutine function. It awaits the keys of
+    the asynchronous predicates concurrently.
+    """
+    sync_getters = []
+    async_getters = []
+    for index, get_key in enumerate(key_getters):
+        if is_coroutine_function(get_key):
+            async_getters.append((index, get_key))
+        else:
+            sync_getters.append((index, get_key))
+    size = len(key_getters)
+
+    async def key(**kw):
+        result = [None] * size
+        for index, get_key in sync_getters:
+            result[index] = get_key(kw)
+        if len(async_getters) == 1:
+            ((index, get_key),) = async_getters
+            result[index] = await get_key(kw)
+        else:
+            import asyncio
+
+            keys = await asyncio.gather(*[get_key(kw) for _, get_key in async_getters])
+            for (index, _), k in zip(async_getters, keys):
+                result[index] = k
+        return tuple(result)
+
+    return key
+
+
+def lazy_key(registry, key_getters):
+    """Make a key function that stops at the first predicate without match.
+
+    The keys of the predicates are computed in order. As soon as the
+    index of a predicate has no registrations for any permutation of
+    its key, no implementation can match, and the key function returns
+    the keys computed so far. The registry finds the fallback for this
+    shorter key, as it only needs the keys up to that predicate.
+
+    If some predicates are asynchronous, the key function is a
+    coroutine function that awaits their keys one by one.
+    """
+    if not registry.is_async:
+
+        def key(**kw):
+            result = []
+            for get_key, index in zip(key_getters, registry.indexes):
+                k = get_key(kw)
+                result.append(k)
+                if not index.matches(k):
+                    break
+            return tuple(result)
+
+        return key
+
+    asynchronous = [is_coroutine_function(get_key) for get_key in key_getters]
+
+    async def key(**kw):
+        result = []
+        for get_key, is_async, index in zip(
+            key_getters, asynchronous, registry.indexes
+        ):
+            k = get_key(kw)
+            if is_async:
+                k = await k
+            result.append(k)
+            if not index.matches(k):
+                break
+        return tuple(result)
+
+    return key
+
+
+# Serializes registrations and the publication of their snapshots.
+# Lookups only take it to publish a snapshot after registrations.
+_register_lock = Lock()
+
+
+class Snapshot(namedtuple("Snapshot", "indexes known_values")):
+    """The registrations of a registry at one point in time.
+
+    Snapshots are never changed, so lookups can use them without
+    locking while implementations are registered.
+    """
+
+    __slots__ = ()
+
+    def get(self, keys):
+        # do an intersection of all sets that result from index lookup
+        # this code is a bit convoluted for performance reasons.
+        sets = (index[key] for index, key in zip(self.indexes, keys))
+        # besides doing the intersection,
+        # this returns the known values if there are no indexes at all
+        return next(sets, self.known_values).intersection(*sets)
 
 
 class PredicateRegistry:
-    def __init__(self, *predicates):
+    """Registry of implementations by predicate key.
+
+    Registrations are added to indexes that only the registry uses.
+    Lookups use a snapshot of them, which is published on the first
+    lookup after registrations, so that a batch of registrations is
+    published at once.
+
+    :param predicates: the :class:`reg.Predicate` instances to do the
+      dispatch on.
+    :param lazy: if true, :meth:`PredicateRegistry.key` computes the
+      keys of the predicates in order and stops as soon as one has no
+      registrations, returning the keys computed so far. This is
+      enough to find the fallback, and saves computing the keys of the
+      remaining predicates.
+    """
+
+    def __init__(self, *predicates, lazy=False):
         self.known_keys = set()
         self.known_values = set()
         self.predicates = predicates
-        self.indexes = [predicate.create_index() for predicate in predicates]
+        # the indexes registrations are added to, with sets of values
+        self._builders = tuple([predicate.create_index() for predicate in predicates])
+        # the positions and key items of the index entries that
+        # changed since the snapshot was published
+        self._changed = set()
+        self._snapshot = Snapshot(
+            tuple([predicate.create_index() for predicate in predicates]), _emptyset
+        )
+        # the snapshot lookups use, or None if there were registrations
+        # since it was published
+        self._current = self._snapshot
+        # counts registrations, so that caches can tell whether
+        # registrations were made since they were filled
+        self.generation = 0
         key_getters = [p.get_key for p in predicates]
-        if len(predicates) == 0:
+        self.is_async = any(is_coroutine_function(p) for p in key_getters)
+        if lazy:
+            self.key = lazy_key(self, key_getters)
+        elif self.is_async:
+            self.key = async_key(key_getters)
+        elif len(predicates) == 0:
             self.key = lambda **kw: ()
         elif len(predicates) == 1:
             (p,) = key_getters
@@ -157,20 +608,72 @@ class PredicateRegistry:
             self.key = lambda **kw: tuple([p(kw) for p in key_getters])
 
     def register(self, key, value):
-        if key in self.known_keys:
-            raise RegistrationError(f"Already have registration for key: {key}")
-        for index, key_item in zip(self.indexes, key):
-            index.setdefault(key_item, set()).add(value)
-        self.known_keys.add(key)
-        self.known_values.add(value)
+        with _register_lock:
+            if key in self.known_keys:
+                raise RegistrationError(f"Already have registration for key: {key}")
+            for position, (builder, key_item) in enumerate(zip(self._builders, key)):
+                values = builder.get(key_item)
+                if values is None:
+                    values = builder[key_item] = set()
+                values.add(value)
+                self._changed.add((position, key_item))
+            self.known_keys.add(key)
+            self.known_values.add(value)
+            self._current = None
+            self.generation += 1
+
+    def snapshot(self):
+        """The snapshot of the registrations to look up implementations in."""
+        snapshot = self._current
+        if snapshot is None:
+            with _register_lock:
+                snapshot = self._current
+                if snapshot is None:
+                    snapshot = self._publish(self._snapshot.indexes)
+        return snapshot
+
+    def _publish(self, indexes):
+        # Publishes a snapshot with copies of indexes, in which the
+        # entries that changed have the values of the builders.
+        new_indexes = []
+        for index in indexes:
+            new_index = type(index)(index.fallback)
+            new_index.update(index)
+            new_indexes.append(new_index)
+        for position, key_item in self._changed:
+            values = self._builders[position][key_item]
+            new_indexes[position][key_item] = frozenset(values)
+        self._changed.clear()
+        snapshot = Snapshot(tuple(new_indexes), frozenset(self.known_values))
+        self._snapshot = self._current = snapshot
+        return snapshot
+
+    @property
+    def indexes(self):
+        """The indexes of the current snapshot."""
+        return self.snapshot().indexes
+
+    def uses_abcs(self):
+        """Whether an abstract base class is registered.
+
+        If so, lookups can change without registrations, as classes
+        can become virtual subclasses of it.
+        """
+        return any(index.abcs for index in self.indexes)
+
+    def accepts(self, key):
+        """Whether key can be looked up, like the keys of calls."""
+        return all(index.accepts(k) for index, k in zip(self.indexes, key))
+
+    def compact(self):
+        """Publish a snapshot without the slack left by registrations."""
+        with _register_lock:
+            for position, builder in enumerate(self._builders):
+                self._changed.update((position, key_item) for key_item in builder)
+            self._publish([type(index)(index.fallback) for index in self._builders])
 
     def get(self, keys):
-        # do an intersection of all sets that result from index lookup
-        # this code is a bit convoluted for performance reasons.
-        sets = (index[key] for index, key in zip(self.indexes, keys))
-        # besides doing the intersection,
-        # this returns the known values if there are no indexes at all
-        return next(sets, self.known_values).intersection(*sets)
+        return self.snapshot().get(keys)
 
     def permutations(self, keys):
         return product(
@@ -182,7 +685,9 @@ class PredicateRegistry:
 
         :param kw: a dictionary with the arguments passed to a generic
           function.
-        :returns: a tuple, to be used as a key for dispatching.
+        :returns: a tuple, to be used as a key for dispatching. If the
+          registry is lazy, this may have fewer items than there are
+          predicates.
 
         """
         # Overwritten by init
@@ -205,14 +710,12 @@ class PredicateRegistry:
 
     def fallback(self, keys):
         result = None
-        for index, key in zip(self.indexes, keys):
-            for k in index.permutations(key):
-                match = index[k]
-                if match:
-                    break
-            else:
+        for index, key in zip(self.snapshot().indexes, keys):
+            candidates = index.candidates(key)
+            if not candidates:
                 # no matching permutation for this key, so this is the fallback
                 return index.fallback
+            match = index[candidates[0]]
             if result is None:
                 result = match
             else:
@@ -223,5 +726,10 @@ class PredicateRegistry:
                 return index.fallback
 
     def all(self, key):
-        for p in self.permutations(key):
-            yield from self.get(p)
+        snapshot = self.snapshot()
+        # Permutations without registrations cannot match, so we only
+        # go through the candidates.
+        for p in product(
+            *(index.candidates(k) for index, k in zip(snapshot.indexes, key))
+        ):
+            yield from snapshot.get(p)
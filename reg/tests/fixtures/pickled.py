@@ -0,0 +1,54 @@
+"Dispatch functions and methods that can be pickled by reference."
+
+from reg import dispatch_method, dispatch
+
+
+class Alpha:
+    pass
+
+
+class Beta:
+    pass
+
+
+@dispatch("obj")
+def title(obj):
+    return "default"
+
+
+@title.register(obj=Alpha)
+def alpha_title(obj):
+    return "alpha"
+
+
+class App:
+    @dispatch_method("obj")
+    def title(self, obj):
+        return "default"
+
+
+class SubApp(App):
+    pass
+
+
+App.title.register(lambda self, obj: "app alpha", obj=Alpha)
+SubApp.title.register(lambda self, obj: "sub app beta", obj=Beta)
+
+
+def call(func, obj):
+    return func(obj)
+
+
+@dispatch("obj")
+def size(obj, factor):
+    return 0
+
+
+@size.register(obj=Alpha)
+def alpha_size(obj, factor):
+    return 1 * factor
+
+
+@size.register(obj=Beta)
+def beta_size(obj, factor):
+    return 2 * factor
@@ -0,0 +1,173 @@
+import abc
+
+import pytest
+
+from ..dispatch import dispatch
+from ..context import dispatch_method
+from ..cache import DictCachingKeyLookup
+from ..predicate import match_instance, match_key, match_class, Predicate, KeyIndex
+
+np = pytest.importorskip("numpy")
+
+
+class Alpha:
+    pass
+
+
+class Beta(Alpha):
+    pass
+
+
+class Gamma:
+    pass
+
+
+@pytest.fixture
+def f():
+    @dispatch("obj", match_key("kind"))
+    def f(obj, kind):
+        return ("fallback", kind)
+
+    f.register(lambda obj, kind: ("alpha", kind), obj=Alpha, kind="x")
+    f.register(lambda obj, kind: ("beta", kind), obj=Beta, kind="y")
+    return f
+
+
+def test_map_arrays(f):
+    objs = np.array([Alpha(), Beta(), Gamma(), Beta(), Alpha(), Beta()])
+    kinds = np.array(["x", "y", "x", "x", "y", "y"], dtype=object)
+    results = f.dispatch.map_arrays(objs, kinds)
+    assert isinstance(results, np.ndarray)
+    assert results.dtype == object
+    assert list(results) == [f(obj, kind) for obj, kind in zip(objs, kinds)]
+    assert list(results) == [
+        ("alpha", "x"),
+        ("beta", "y"),
+        ("fallback", "x"),
+        ("alpha", "x"),
+        ("fallback", "y"),
+        ("beta", "y"),
+    ]
+
+
+def test_map_arrays_sequences(f):
+    results = f.dispatch.map_arrays([Alpha(), Gamma()], ("x", "x"))
+    assert list(results) == [("alpha", "x"), ("fallback", "x")]
+
+
+def test_map_arrays_converts_to_objects():
+    @dispatch("value")
+    def f(value):
+        return "fallback"
+
+    f.register(lambda value: "int", value=int)
+
+    assert list(f.dispatch.map_arrays(np.arange(3))) == ["int", "int", "int"]
+
+
+def test_map_arrays_empty(f):
+    assert len(f.dispatch.map_arrays([], [])) == 0
+
+
+def test_map_arrays_no_predicates():
+    @dispatch()
+    def f(a):
+        return a * 2
+
+    assert list(f.dispatch.map_arrays(np.arange(3))) == [0, 2, 4]
+
+
+def test_map_arrays_resolves_once_per_key():
+    resolved = []
+
+    def get_key_lookup(registry):
+        class KeyLookup:
+            def component(self, key):
+                resolved.append(key)
+                return registry.component(key)
+
+            fallback = registry.fallback
+            all = registry.all
+
+        return KeyLookup()
+
+    @dispatch("obj", get_key_lookup=get_key_lookup)
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "alpha", obj=Alpha)
+
+    objs = [Alpha(), Gamma(), Alpha(), Alpha(), Gamma()]
+    assert list(f.dispatch.map_arrays(objs)) == [
+        "alpha",
+        "fallback",
+        "alpha",
+        "alpha",
+        "fallback",
+    ]
+    assert sorted(key[0].__name__ for key in resolved) == ["Alpha", "Gamma"]
+
+
+def test_map_arrays_key_functions():
+    @dispatch(
+        match_instance("obj", lambda obj, other: other),
+        match_class("cls", lambda obj, other: type(obj)),
+        Predicate("length", KeyIndex, lambda d: len(d["obj"])),
+    )
+    def f(obj, other):
+        return "fallback"
+
+    f.register(lambda obj, other: "match", obj=Alpha, cls=str, length=2)
+
+    assert list(
+        f.dispatch.map_arrays(["ab", "ab", "abc"], [Beta(), Gamma(), Beta()])
+    ) == [
+        "match",
+        "fallback",
+        "fallback",
+    ]
+
+
+def test_map_arrays_dispatch_method():
+    class App:
+        @dispatch_method("obj")
+        def f(self, obj):
+            return "fallback"
+
+    App.f.register(lambda self, obj: "alpha", obj=Alpha)
+    app = App()
+
+    assert list(App.f.dispatch.map_arrays([app, app], [Alpha(), Gamma()])) == [
+        "alpha",
+        "fallback",
+    ]
+
+
+def test_map_arrays_wrong_number_of_arrays(f):
+    with pytest.raises(TypeError):
+        f.dispatch.map_arrays([Alpha()])
+
+
+def test_map_arrays_different_lengths(f):
+    with pytest.raises(ValueError):
+        f.dispatch.map_arrays([Alpha()], ["x", "y"])
+
+
+def test_map_arrays_not_one_dimensional(f):
+    with pytest.raises(ValueError):
+        f.dispatch.map_arrays(np.empty((1, 1), dtype=object), ["x"])
+
+
+def test_map_arrays_virtual_subclass():
+    class Sized(abc.ABC):
+        pass
+
+    @dispatch("obj", get_key_lookup=DictCachingKeyLookup)
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "sized", obj=Sized)
+
+    assert list(f.dispatch.map_arrays([Gamma()])) == ["fallback"]
+    Sized.register(Gamma)
+    assert list(f.dispatch.map_arrays([Gamma()])) == ["sized"]
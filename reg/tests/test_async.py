@@ -0,0 +1,375 @@
+import asyncio
+import inspect
+
+import pytest
+
+from ..context import dispatch_method, methodify
+from ..arginfo import is_coroutine_function
+from ..dispatch import dispatch
+from ..error import RegistrationError
+from ..predicate import match_class, match_instance, match_key
+
+
+class Foo:
+    pass
+
+
+class Bar:
+    pass
+
+
+def test_async_dispatch():
+    @dispatch("obj")
+    async def f(obj):
+        return "fallback"
+
+    @f.register(obj=Foo)
+    async def f_foo(obj):
+        return "foo"
+
+    assert f.dispatch.is_async
+    assert is_coroutine_function(f)
+    assert asyncio.run(f(Foo())) == "foo"
+    assert asyncio.run(f(Bar())) == "fallback"
+
+
+def test_async_dispatch_returns_coroutine_of_implementation():
+    @dispatch("obj")
+    async def f(obj):
+        return "fallback"
+
+    @f.register(obj=Foo)
+    async def f_foo(obj):
+        return "foo"
+
+    coroutine = f(Foo())
+    # there is no coroutine wrapping the one of the implementation
+    assert coroutine.cr_code is f_foo.__code__
+    assert asyncio.run(coroutine) == "foo"
+
+
+def test_async_dispatch_register_non_coroutine_function():
+    @dispatch("obj")
+    async def f(obj):
+        return "fallback"
+
+    def f_foo(obj):
+        return "foo"
+
+    with pytest.raises(RegistrationError):
+        f.register(f_foo, obj=Foo)
+
+
+def test_sync_dispatch_register_coroutine_function():
+    @dispatch("obj")
+    def f(obj):
+        return "fallback"
+
+    @f.register(obj=Foo)
+    async def f_foo(obj):
+        return "foo"
+
+    assert not f.dispatch.is_async
+    assert asyncio.run(f(Foo())) == "foo"
+
+
+def test_async_dispatch_predicate_fallback():
+    async def fallback(obj):
+        return "predicate fallback"
+
+    @dispatch(match_instance("obj", fallback=fallback))
+    async def f(obj):
+        return "fallback"
+
+    @f.register(obj=Foo)
+    async def f_foo(obj):
+        return "foo"
+
+    assert asyncio.run(f(Foo())) == "foo"
+    assert asyncio.run(f(Bar())) == "predicate fallback"
+
+
+def test_async_dispatch_non_coroutine_predicate_fallback():
+    def fallback(obj):
+        return "predicate fallback"
+
+    with pytest.raises(RegistrationError):
+
+        @dispatch(match_instance("obj", fallback=fallback))
+        async def f(obj):
+            return "fallback"
+
+
+def test_async_dispatch_method():
+    class App:
+        @dispatch_method("obj")
+        async def f(self, obj):
+            return "fallback"
+
+    async def f_foo(obj):
+        return "foo"
+
+    App.f.register(methodify(f_foo), obj=Foo)
+
+    def f_bar(obj):
+        return "bar"
+
+    with pytest.raises(RegistrationError):
+        App.f.register(methodify(f_bar), obj=Bar)
+
+    app = App()
+    assert asyncio.run(app.f(Foo())) == "foo"
+    assert asyncio.run(app.f(Bar())) == "fallback"
+
+
+def test_async_first_invocation_hook():
+    hooked = []
+
+    async def hook(app):
+        await asyncio.sleep(0)
+        hooked.append(app)
+
+    class App:
+        @dispatch_method("obj", first_invocation_hook=hook)
+        async def f(self, obj):
+            return "fallback"
+
+    async def f_foo(obj):
+        return "foo"
+
+    App.f.register(methodify(f_foo), obj=Foo)
+
+    app = App()
+    assert hooked == []
+    # the dispatch method can be used before it is first invoked
+    method = app.f
+    assert is_coroutine_function(method)
+    assert method.__name__ == "f"
+    assert str(inspect.signature(method)) == "(obj)"
+    assert method.dispatch is App.f.dispatch
+    assert method.by_args(Foo()).component is not None
+    assert method.by_predicates(obj=Bar).component is None
+    assert method.wrapped_func is App.f.wrapped_func
+
+    async def f_bar(obj):
+        return "bar"
+
+    method.register(methodify(f_bar), obj=Bar)
+    assert hooked == []
+
+    async def invoke():
+        return await asyncio.gather(app.f(Foo()), app.f(Bar()))
+
+    assert asyncio.run(invoke()) == ["foo", "bar"]
+    # the hook is awaited once, even for concurrent invocations
+    assert hooked == [app]
+    # after which the method no longer goes through the hook
+    assert app.f.__func__ is App.f
+    assert asyncio.run(app.f(Foo())) == "foo"
+    assert hooked == [app]
+
+
+def test_async_first_invocation_hook_fails():
+    failures = [RuntimeError("failed")]
+
+    async def hook(app):
+        if failures:
+            raise failures.pop()
+
+    class App:
+        @dispatch_method("obj", first_invocation_hook=hook)
+        async def f(self, obj):
+            return "fallback"
+
+    app = App()
+    with pytest.raises(RuntimeError):
+        asyncio.run(app.f(Foo()))
+    # the hook is awaited again on the next invocation
+    assert asyncio.run(app.f(Foo())) == "fallback"
+    assert app.f.__func__ is App.f
+
+
+def test_async_first_invocation_hook_non_asynchronous_method():
+    async def hook(app):
+        pass
+
+    with pytest.raises(RegistrationError):
+
+        class App:
+            @dispatch_method("obj", first_invocation_hook=hook)
+            def f(self, obj):
+                return "fallback"
+
+
+def test_methodify_coroutine_function():
+    async def f_foo(obj):
+        return "foo"
+
+    method = methodify(f_foo, "app")
+    assert is_coroutine_function(method)
+    assert str(inspect.signature(method)) == "(app, obj)"
+    assert asyncio.run(method(None, Foo())) == "foo"
+
+    bound = methodify(App().f_self, "self")
+    assert is_coroutine_function(bound)
+    assert str(inspect.signature(bound)) == "(self, obj)"
+    assert asyncio.run(bound(None, Foo())) == "self"
+
+
+def test_async_predicate():
+    async def get_user(request):
+        await asyncio.sleep(0)
+        return request["user"]
+
+    @dispatch(match_key("user", get_user))
+    async def view(request):
+        return "anonymous"
+
+    @view.register(user="admin")
+    async def admin_view(request):
+        return "admin"
+
+    assert asyncio.run(view({"user": "admin"})) == "admin"
+    assert asyncio.run(view({"user": "someone"})) == "anonymous"
+
+    async def by_args():
+        return await view.by_args({"user": "admin"})
+
+    assert asyncio.run(by_args()).component is admin_view
+
+
+def test_async_predicates_are_awaited_concurrently():
+    async def get_user(obj, request):
+        # only finishes if the other key is computed concurrently
+        await request["permission_asked"].wait()
+        return request["user"]
+
+    async def get_permission(obj, request):
+        request["permission_asked"].set()
+        return request["permission"]
+
+    @dispatch(
+        "obj",
+        match_key("user", get_user),
+        match_key("permission", get_permission),
+    )
+    async def view(obj, request):
+        return "forbidden"
+
+    @view.register(obj=Foo, user="admin", permission="edit")
+    async def edit_view(obj, request):
+        return "edit"
+
+    async def invoke(permission):
+        request = {
+            "user": "admin",
+            "permission": permission,
+            "permission_asked": asyncio.Event(),
+        }
+        return await asyncio.wait_for(view(Foo(), request), 1)
+
+    assert asyncio.run(invoke("edit")) == "edit"
+    assert asyncio.run(invoke("view")) == "forbidden"
+
+
+def test_async_instance_predicate():
+    async def get_model(request):
+        return request["model"]
+
+    @dispatch(match_instance("model", get_model))
+    async def view(request):
+        return "fallback"
+
+    @view.register(model=Foo)
+    async def foo_view(request):
+        return "foo"
+
+    assert asyncio.run(view({"model": Foo()})) == "foo"
+    assert asyncio.run(view({"model": Bar()})) == "fallback"
+
+
+def test_async_class_predicate():
+    async def get_model_class(request):
+        return request["model_class"]
+
+    @dispatch(match_class("model_class", get_model_class))
+    async def view(request):
+        return "fallback"
+
+    @view.register(model_class=Foo)
+    async def foo_view(request):
+        return "foo"
+
+    assert asyncio.run(view({"model_class": Foo})) == "foo"
+    assert asyncio.run(view({"model_class": Bar})) == "fallback"
+
+
+def test_add_async_predicates():
+    async def get_user(obj, user):
+        return user
+
+    @dispatch("obj")
+    async def view(obj, user):
+        return "fallback"
+
+    view.add_predicates([match_key("user", get_user)])
+    view.register(f_admin, obj=Foo, user="admin")
+    assert asyncio.run(view(Foo(), "admin")) == "admin"
+    assert asyncio.run(view(Foo(), "someone")) == "fallback"
+
+    view.clean()
+    view.register(f_admin, obj=Foo)
+    assert asyncio.run(view(Foo(), "someone")) == "admin"
+
+
+def test_async_predicates_for_non_asynchronous_dispatch():
+    async def get_user(request):
+        return request["user"]
+
+    with pytest.raises(RegistrationError):
+
+        @dispatch(match_key("user", get_user))
+        def view(request):
+            return "anonymous"
+
+
+def test_async_predicates_not_computed_synchronously():
+    async def get_user(request):
+        return request["user"]
+
+    @dispatch(match_key("user", get_user))
+    async def view(request):
+        return "anonymous"
+
+    with pytest.raises(TypeError):
+        view.dispatch.by_args_many([({"user": "admin"},)])
+    with pytest.raises(TypeError):
+        view.dispatch.map([({"user": "admin"},)])
+    with pytest.raises(TypeError):
+        view.dispatch.stream([({"user": "admin"},)])
+
+
+def test_lazy_async_predicates():
+    computed = []
+
+    async def get_user(obj, user):
+        computed.append(user)
+        return user
+
+    @dispatch("obj", match_key("user", get_user), lazy=True)
+    async def view(obj, user):
+        return "fallback"
+
+    view.register(f_admin, obj=Foo, user="admin")
+    assert asyncio.run(view(Foo(), "admin")) == "admin"
+    assert asyncio.run(view(Bar(), "admin")) == "fallback"
+    assert computed == ["admin"]
+
+
+async def f_admin(obj, user):
+    return "admin"
+
+
+class App:
+    async def f_self(self, obj):
+        return "self"
@@ -0,0 +1,202 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from ..dispatch import dispatch
+from ..context import dispatch_method
+from ..cache import DictCachingKeyLookup
+from .fixtures.pickled import size, Alpha, Beta
+
+
+class CountingKeyLookup:
+    def __init__(self, key_lookup):
+        self.key_lookup = key_lookup
+        self.keys = []
+
+    def component(self, key):
+        self.keys.append(key)
+        return self.key_lookup.component(key)
+
+    def fallback(self, key):
+        return self.key_lookup.fallback(key)
+
+    def all(self, key):
+        return self.key_lookup.all(key)
+
+
+class Foo:
+    pass
+
+
+class Bar:
+    pass
+
+
+class Qux:
+    pass
+
+
+@pytest.fixture
+def f():
+    @dispatch("obj", get_key_lookup=CountingKeyLookup)
+    def f(obj, extra):
+        return ("fallback", extra)
+
+    f.register(lambda obj, extra: ("foo", extra), obj=Foo)
+    f.register(lambda obj, extra: ("bar", extra), obj=Bar)
+    return f
+
+
+def arguments(amount):
+    classes = [Foo, Bar, Qux]
+    return [(classes[i % 3](), i) for i in range(amount)]
+
+
+def expected(amount):
+    names = ["foo", "bar", "fallback"]
+    return [(names[i % 3], i) for i in range(amount)]
+
+
+def test_map(f):
+    assert f.dispatch.map(arguments(10)) == expected(10)
+    # an implementation is looked up once for each key
+    assert f.key_lookup.keys == [(Foo,), (Bar,), (Qux,)]
+    assert f.dispatch.map(iter(arguments(10))) == expected(10)
+    assert f.dispatch.map([]) == []
+
+
+def test_map_same_as_call(f):
+    assert f.dispatch.map(arguments(10)) == [f(*args) for args in arguments(10)]
+
+
+@pytest.mark.parametrize("chunksize", [None, 1, 2, 100])
+def test_map_thread_pool(f, chunksize):
+    with ThreadPoolExecutor(4) as executor:
+        assert f.dispatch.map(arguments(50), executor, chunksize) == expected(50)
+    assert len(f.key_lookup.keys) == 3
+
+
+def test_map_error(f):
+    f.register(lambda obj, extra: 1 / extra, obj=Qux)
+    with pytest.raises(ZeroDivisionError):
+        f.dispatch.map([(Qux(), 0)])
+    with ThreadPoolExecutor(2) as executor:
+        with pytest.raises(ZeroDivisionError):
+            f.dispatch.map([(Foo(), 1), (Qux(), 0)], executor)
+
+
+def test_map_wrong_arguments(f):
+    with pytest.raises(TypeError):
+        f.dispatch.map([(Foo(),)])
+
+
+def test_map_process_pool():
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(2, mp_context=context) as executor:
+        assert size.dispatch.map(
+            [(Alpha(), 1), (Beta(), 2), (None, 3), (Alpha(), 4)], executor
+        ) == [1, 4, 0, 4]
+
+
+def test_map_dispatch_method():
+    class App:
+        @dispatch_method("obj", get_key_lookup=DictCachingKeyLookup)
+        def f(self, obj):
+            return "fallback"
+
+    App.f.register(lambda self, obj: "foo", obj=Foo)
+    app = App()
+    assert App.f.dispatch.map([(app, Foo()), (app, Bar())]) == ["foo", "fallback"]
+    assert app.f.dispatch.map([(app, Foo())]) == ["foo"]
+
+
+def test_stream(f):
+    consumed = []
+
+    def generate():
+        for args in arguments(10):
+            consumed.append(args)
+            yield args
+
+    results = f.dispatch.stream(generate())
+    assert consumed == []
+    assert next(results) == ("foo", 0)
+    assert len(consumed) == 1
+    assert list(results) == expected(10)[1:]
+    # an implementation is looked up once for each key
+    assert f.key_lookup.keys == [(Foo,), (Bar,), (Qux,)]
+
+
+def test_stream_cache_size(f):
+    args = [(Foo(), 0), (Bar(), 1), (Foo(), 2), (Qux(), 3), (Foo(), 4)]
+    assert list(f.dispatch.stream(args, cache_size=2)) == [
+        ("foo", 0),
+        ("bar", 1),
+        ("foo", 2),
+        ("fallback", 3),
+        ("foo", 4),
+    ]
+    # the remembered implementations are forgotten when there are
+    # too many of them
+    assert f.key_lookup.keys == [(Foo,), (Bar,), (Qux,), (Foo,)]
+
+
+def test_stream_async(f):
+    async def generate():
+        for args in arguments(10):
+            yield args
+
+    async def consume():
+        return [result async for result in f.dispatch.stream(generate())]
+
+    assert asyncio.run(consume()) == expected(10)
+    assert f.key_lookup.keys == [(Foo,), (Bar,), (Qux,)]
+
+
+def test_by_args_many(f):
+    entries = f.dispatch.by_args_many(arguments(6))
+    assert [entry.key for entry in entries] == [
+        (Foo,),
+        (Bar,),
+        (Qux,),
+        (Foo,),
+        (Bar,),
+        (Qux,),
+    ]
+    # arguments with the same key share an entry
+    assert entries[0] is entries[3]
+    assert entries[2] is entries[5]
+    assert entries[0].component(Foo(), 0) == ("foo", 0)
+    assert entries[2].component is None
+    assert entries[2].fallback is None
+
+
+def test_by_args_many_empty(f):
+    assert f.dispatch.by_args_many([]) == []
+
+
+def test_by_predicates_many(f):
+    entries = f.dispatch.by_predicates_many(
+        [{"obj": Foo}, {"obj": Bar}, {"obj": Foo}, {}]
+    )
+    assert [entry.key for entry in entries] == [(Foo,), (Bar,), (Foo,), (None,)]
+    assert entries[0] is entries[2]
+    assert entries[1].component(Bar(), 1) == ("bar", 1)
+
+
+def test_by_args_many_dispatch_method():
+    class App:
+        @dispatch_method("obj")
+        def f(self, obj):
+            return "fallback"
+
+    App.f.register(lambda self, obj: "foo", obj=Foo)
+    app = App()
+    for f in [App.f, app.f]:
+        entries = f.dispatch.by_args_many([(Foo(),), (Bar(),), (Foo(),)])
+        assert [entry.key for entry in entries] == [(Foo,), (Bar,), (Foo,)]
+        assert entries[0] is entries[2]
+        assert entries[0].component(app, Foo()) == "foo"
+        assert entries[1].component is None
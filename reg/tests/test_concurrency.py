@@ -0,0 +1,265 @@
+import sys
+import threading
+
+import pytest
+from repoze.lru import LRUCache
+
+from .. import cache as cache_module
+from ..dispatch import dispatch
+from ..predicate import Predicate, ClassIndex
+from ..cache import (
+    Cache,
+    DictCachingKeyLookup,
+    LruCachingKeyLookup,
+    ThreadLocalCachingKeyLookup,
+    single_flight,
+    thread_local_cache,
+)
+
+THREADS = 4
+CLASSES = 200
+
+
+@pytest.fixture
+def switch_often():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def run_threads(targets):
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup",
+    [
+        lambda r: r,
+        DictCachingKeyLookup,
+        lambda r: LruCachingKeyLookup(r, 50, 50, 50),
+        ThreadLocalCachingKeyLookup,
+    ],
+)
+def test_register_while_calling(switch_often, get_key_lookup):
+    class Base:
+        pass
+
+    classes = [type(f"C{i}", (Base,), {}) for i in range(CLASSES)]
+
+    @dispatch("obj", "other", get_key_lookup=get_key_lookup)
+    def f(obj, other):
+        return "fallback"
+
+    def make_impl(i):
+        return lambda obj, other: i
+
+    def register(start):
+        for i in range(start, CLASSES, THREADS):
+            f.register(make_impl(i), obj=classes[i], other=Base)
+
+    def call(start):
+        for n in range(5):
+            for i in range(start, CLASSES, THREADS):
+                assert f(classes[i](), classes[i]()) in (i, "fallback")
+                assert f.by_args(classes[i](), classes[i]()).all_matches in (
+                    [],
+                    [f.by_predicates(obj=classes[i], other=Base).component],
+                )
+
+    run_threads(
+        [lambda i=i: register(i) for i in range(THREADS)]
+        + [lambda i=i: call(i) for i in range(THREADS)]
+    )
+
+    for i, class_ in enumerate(classes):
+        assert f(class_(), class_()) == i
+
+
+def slow_function():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def func(key):
+        calls.append(key)
+        if key == "slow":
+            started.set()
+            release.wait()
+        if key == "error":
+            started.set()
+            release.wait()
+            raise ValueError(key)
+        return object()
+
+    return func, calls, started, release
+
+
+@pytest.mark.parametrize(
+    "make_cached",
+    [
+        lambda func: Cache(func).__getitem__,
+        single_flight,
+        lambda func: single_flight(func, LRUCache(10)),
+    ],
+)
+def test_single_flight(make_cached):
+    func, calls, started, release = slow_function()
+    cached = make_cached(func)
+    results = []
+
+    leader = threading.Thread(target=lambda: results.append(cached("slow")))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(cached("slow")))
+        for i in range(THREADS)
+    ]
+    for thread in followers:
+        thread.start()
+
+    # other keys are not blocked by the computation in progress
+    assert cached("other") is not None
+
+    release.set()
+    leader.join()
+    for thread in followers:
+        thread.join()
+
+    assert calls.count("slow") == 1
+    assert len(results) == THREADS + 1
+    assert all(result is results[0] for result in results)
+
+
+@pytest.mark.parametrize(
+    "make_cached",
+    [
+        lambda func: Cache(func).__getitem__,
+        single_flight,
+        lambda func: single_flight(func, LRUCache(10)),
+    ],
+)
+def test_single_flight_error(make_cached):
+    func, calls, started, release = slow_function()
+    cached = make_cached(func)
+    errors = []
+
+    def call():
+        try:
+            cached("error")
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for i in range(THREADS)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == THREADS
+    # threads that waited for a computation share its error
+    computations = len({id(error) for error in errors})
+    assert computations < THREADS
+    # the failed computation is not cached, so we try again next time
+    with pytest.raises(ValueError):
+        cached("error")
+    assert calls.count("error") == computations + 1
+
+
+def test_single_flight_stores_in_cache():
+    calls = []
+    cache = LRUCache(10)
+
+    def func(key):
+        calls.append(key)
+        return key.upper()
+
+    cached = single_flight(func, cache)
+    assert cached("a") == "A"
+    assert cache.get(("a",)) == "A"
+    cache.put(("b",), "cached B")
+    assert cached("b") == "cached B"
+    assert calls == ["a"]
+
+
+def test_cache_stored_while_waiting_for_lock():
+    cache = Cache(lambda key: "computed")
+    # as if another thread stored it just before we took the lock
+    dict.__setitem__(cache, "a", "stored")
+    assert cache.__missing__("a") == "stored"
+    assert cache.flights == {}
+
+
+def test_thread_local_cache_takes_no_lock(monkeypatch):
+    class NoLock:
+        def __enter__(self):
+            raise AssertionError("thread local caches take no lock")
+
+    monkeypatch.setattr(cache_module, "_flight_lock", NoLock())
+    calls = []
+
+    def func(key):
+        calls.append(key)
+        return key.upper()
+
+    cached = thread_local_cache(func)
+    assert cached("a") == "A"
+    assert cached("a") == "A"
+    assert calls == ["a"]
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup",
+    [
+        DictCachingKeyLookup,
+        lambda r: LruCachingKeyLookup(r, 50, 50, 50),
+    ],
+)
+def test_single_flight_dispatch(switch_often, get_key_lookup):
+    class Base:
+        pass
+
+    class Sub(Base):
+        pass
+
+    calls = []
+
+    class CountingIndex(ClassIndex):
+        __slots__ = ()
+
+        def permutations(self, key):
+            calls.append(key)
+            return super().permutations(key)
+
+    @dispatch(
+        Predicate("obj", CountingIndex, lambda d: d["obj"].__class__),
+        get_key_lookup=get_key_lookup,
+    )
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "base", obj=Base)
+
+    def call():
+        assert f(Sub()) == "base"
+
+    run_threads([call] * THREADS)
+
+    # computing the component looks at the permutations once
+    assert calls == [Sub]
@@ -1,8 +1,14 @@
+import abc
+import collections.abc
+import typing
+
 import pytest
 
-from ..predicate import match_instance, match_key, match_class
-from ..dispatch import dispatch
+from ..predicate import match_instance, match_key, match_class, match_protocol
+from ..dispatch import dispatch, Dispatch, DispatchGroup
 from ..error import RegistrationError
+from ..cache import DictCachingKeyLookup, ThreadLocalCachingKeyLookup
+from ..dispatch import ClassImplementations
 
 
 class IAlpha:
@@ -1110,3 +1116,485 @@ def test_predicate_key_wrong_keyword_argument_gives_typeerror():
 
     with pytest.raises(TypeError):
         assert foo.by_args(wrong=1)
+
+
+def test_dispatch_functions_share_code():
+    @dispatch("obj")
+    def foo(obj):
+        return "foo"
+
+    @dispatch("obj")
+    def bar(obj):
+        return "bar"
+
+    assert foo.__code__ is bar.__code__
+    assert foo.__globals__ is bar.__globals__
+
+    class Alpha:
+        pass
+
+    foo.register(lambda obj: "foo alpha", obj=Alpha)
+
+    assert foo(Alpha()) == "foo alpha"
+    assert bar(Alpha()) == "bar"
+    assert foo.by_args(Alpha()).component is not None
+    assert bar.by_args(Alpha()).component is None
+
+
+def test_dispatch_function_attributes():
+    @dispatch("obj")
+    def foo(obj):
+        return "foo"
+
+    assert isinstance(foo.dispatch, Dispatch)
+    assert foo.register.__self__ is foo.dispatch
+    assert foo.dispatch.call is foo
+    assert foo.wrapped_func is foo.dispatch.wrapped_func
+    # the other methods of the dispatch don't add to every function
+    assert not hasattr(foo, "map")
+    assert set(vars(foo)) == {
+        "__wrapped__",
+        "dispatch",
+        "wrapped_func",
+        "key_lookup",
+        "add_predicates",
+        "by_args",
+        "by_predicates",
+        "clean",
+        "register",
+    }
+
+
+def test_dispatch_group():
+    keys = []
+
+    def get_method(obj, request):
+        keys.append(request)
+        return request
+
+    group = DispatchGroup("obj", match_key("method", get_method))
+
+    @group
+    def view(obj, request):
+        return "view fallback"
+
+    @group
+    def permission(obj, request):
+        return "permission fallback"
+
+    class Foo:
+        pass
+
+    @view.register(obj=Foo, method="GET")
+    def foo_view(obj, request):
+        return "foo view"
+
+    @permission.register(obj=object, method="GET")
+    def object_permission(obj, request):
+        return "object permission"
+
+    assert group.members == [view.register.__self__, permission.register.__self__]
+    assert group.resolve(Foo(), "GET") == (foo_view, object_permission)
+    assert keys == ["GET"]
+    assert group.resolve(object(), "GET") == (view.wrapped_func, object_permission)
+    assert group.resolve(Foo(), "POST") == (
+        view.wrapped_func,
+        permission.wrapped_func,
+    )
+    assert keys == ["GET", "GET", "POST"]
+    # the members are dispatch functions of their own
+    assert view(Foo(), "GET") == "foo view"
+    assert permission(Foo(), "POST") == "permission fallback"
+
+
+def test_dispatch_group_predicate_fallback():
+    group = DispatchGroup(match_instance("obj", fallback=lambda obj: "no obj"))
+
+    @group
+    def view(obj):
+        return "fallback"
+
+    assert group.resolve(object())[0](object()) == "no obj"
+
+
+def test_dispatch_group_without_members():
+    assert DispatchGroup("obj").resolve(object()) == ()
+
+
+def test_dispatch_group_member_signature():
+    group = DispatchGroup("obj")
+
+    @group
+    def view(obj):
+        pass
+
+    with pytest.raises(RegistrationError):
+
+        @group
+        def link(obj, request):
+            pass
+
+
+def test_dispatch_group_lazy():
+    with pytest.raises(TypeError):
+        DispatchGroup("obj", lazy=True)
+
+
+def test_resolve():
+    class Foo:
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    @dispatch(match_instance("obj", fallback=lambda obj, extra: "predicate fallback"))
+    def f(obj, extra):
+        return "fallback"
+
+    @f.register(obj=Foo)
+    def f_foo(obj, extra):
+        return "foo %s" % extra
+
+    assert f.dispatch.resolve(FooSub(), 1) is f_foo
+    assert f.dispatch.resolve(object(), 1)(object(), 1) == "predicate fallback"
+
+    @dispatch("obj")
+    def g(obj):
+        return "fallback"
+
+    assert g.dispatch.resolve(object()) is g.wrapped_func
+
+
+def test_call_with_key():
+    class Foo:
+        pass
+
+    @dispatch(match_instance("obj", fallback=lambda obj, extra: "predicate fallback"))
+    def f(obj, extra):
+        return "fallback"
+
+    @f.register(obj=Foo)
+    def f_foo(obj, extra):
+        return "foo %s" % extra
+
+    key = f.by_args(Foo(), 0).key
+    assert [f.dispatch.call_with_key(key, Foo(), i) for i in range(3)] == [
+        "foo 0",
+        "foo 1",
+        "foo 2",
+    ]
+    assert f.dispatch.call_with_key((object,), object(), 0) == "predicate fallback"
+    assert f.dispatch.call_with_key(key, Foo(), extra=3) == f(Foo(), extra=3)
+
+    @dispatch()
+    def g(obj):
+        return "fallback"
+
+    assert g.dispatch.call_with_key((), object()) == "fallback"
+
+
+def test_dispatch_without_predicates_calls_implementation_directly():
+    @dispatch()
+    def emailer():
+        return "default emailer"
+
+    assert emailer() == "default emailer"
+
+    def smtp_emailer():
+        return "smtp emailer"
+
+    emailer.register(smtp_emailer)
+    assert emailer() == "smtp emailer"
+    # the implementation is bound into the dispatch function
+    assert smtp_emailer in [cell.cell_contents for cell in emailer.__closure__]
+    assert emailer.by_args().component is smtp_emailer
+
+    emailer.clean()
+    assert emailer() == "default emailer"
+
+    emailer.register(smtp_emailer)
+    emailer.add_predicates([match_key("kind", lambda: "smtp")])
+    assert emailer() == "default emailer"
+    emailer.register(smtp_emailer, kind="smtp")
+    assert emailer() == "smtp emailer"
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup", [lambda r: r, DictCachingKeyLookup, ThreadLocalCachingKeyLookup]
+)
+def test_dispatch_single_instance_predicate(get_key_lookup):
+    class Foo:
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    @dispatch(
+        match_instance("obj", fallback=lambda obj, extra: "predicate fallback"),
+        get_key_lookup=get_key_lookup,
+    )
+    def f(obj, extra=None):
+        return "fallback"
+
+    assert f(Foo()) == "predicate fallback"
+
+    @f.register(obj=Foo)
+    def f_foo(obj, extra=None):
+        return "foo %s" % extra
+
+    assert f(FooSub(), 1) == "foo 1"
+    assert f(obj=FooSub(), extra=2) == "foo 2"
+    assert f(object()) == "predicate fallback"
+    assert f.by_args(FooSub()).component is f_foo
+
+    f.register(lambda obj, extra=None: "foo sub", obj=FooSub)
+    assert f(FooSub()) == "foo sub"
+    assert f(Foo()) == "foo None"
+
+    f.add_predicates([match_key("extra")])
+    assert f(FooSub()) == "predicate fallback"
+    f.register(f_foo, obj=Foo, extra=None)
+    assert f(FooSub()) == "foo None"
+
+    f.clean()
+    f.register(f_foo, obj=Foo)
+    assert f(FooSub()) == "foo None"
+
+
+def test_dispatch_single_instance_predicate_looks_up_by_class():
+    @dispatch("obj", get_key_lookup=DictCachingKeyLookup)
+    def f(obj):
+        return "fallback"
+
+    @dispatch("obj", get_key_lookup=ThreadLocalCachingKeyLookup)
+    def g(obj):
+        return "fallback"
+
+    @dispatch(match_instance("obj", lambda obj: obj))
+    def h(obj):
+        return "fallback"
+
+    @dispatch("obj")
+    def i(obj):
+        return "fallback"
+
+    assert f.__code__.co_name == "class_call"
+    # the key lookup caches per thread, so is not replaced
+    assert g.__code__.co_name == "call"
+    assert h.__code__.co_name == "call"
+    # without a cache, nothing is cached by class either
+    assert i.__code__.co_name == "call"
+
+
+def test_class_implementations():
+    class Foo:
+        pass
+
+    resolved = []
+
+    def resolve(key):
+        resolved.append(key)
+        return key[0].__name__
+
+    class Bar:
+        pass
+
+    class Qux(Foo):
+        pass
+
+    implementations = ClassImplementations(resolve)
+    assert implementations((Foo,)) == "Foo"
+    assert implementations[Foo.__mro__] == "Foo"
+    assert implementations((Qux,)) == "Qux"
+    assert resolved == [(Foo,), (Qux,)]
+    # the implementation is resolved again when the mro changes
+    Qux.__bases__ = (Bar,)
+    assert implementations((Qux,)) == "Qux"
+    assert resolved == [(Foo,), (Qux,), (Qux,)]
+
+
+def test_dispatch_bases_reassigned():
+    class A:
+        pass
+
+    class B:
+        pass
+
+    class C(B):
+        pass
+
+    @dispatch("obj")
+    def f(obj):
+        return "fallback"
+
+    a = f.register(lambda obj: "a", obj=A)
+
+    assert f(C()) == "fallback"
+    C.__bases__ = (A,)
+    assert f(C()) == "a"
+    assert f.by_args(C()).component is a
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup", [lambda r: r, DictCachingKeyLookup, ThreadLocalCachingKeyLookup]
+)
+def test_dispatch_virtual_subclass(get_key_lookup):
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    class Bar:
+        pass
+
+    Sized.register(Foo)
+
+    @dispatch("obj", get_key_lookup=get_key_lookup)
+    def f(obj):
+        return "fallback"
+
+    @f.register(obj=Sized)
+    def f_sized(obj):
+        return "sized"
+
+    assert f(Foo()) == "sized"
+    assert f(Bar()) == "fallback"
+    assert f.by_args(Foo()).all_matches == [f_sized]
+
+    # a new virtual subclass is noticed, even if the lookup was cached
+    Sized.register(Bar)
+    assert f(Bar()) == "sized"
+    assert f.by_args(Bar()).component is f_sized
+
+    # also if by_args is the first to notice it
+    class Qux:
+        pass
+
+    assert f(Qux()) == "fallback"
+    Sized.register(Qux)
+    assert f.by_args(Qux()).component is f_sized
+    assert f(Qux()) == "sized"
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup", [lambda r: r, DictCachingKeyLookup, ThreadLocalCachingKeyLookup]
+)
+def test_dispatch_virtual_subclass_without_key(get_key_lookup):
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    group = DispatchGroup("obj", get_key_lookup=get_key_lookup)
+
+    @group
+    def view(obj):
+        return "fallback"
+
+    @group
+    def perm(obj):
+        return "fallback"
+
+    @perm.register(obj=Sized)
+    def perm_sized(obj):
+        return "sized"
+
+    # the lookups are cached before Foo becomes a virtual subclass
+    assert perm(Foo()) == "fallback"
+    assert perm.dispatch.call_with_key((Foo,), Foo()) == "fallback"
+    assert perm.by_predicates(obj=Foo).component is None
+    assert group.resolve(Foo()) == (view.wrapped_func, perm.wrapped_func)
+
+    Sized.register(Foo)
+
+    # methods that look up implementations without computing a key
+    # notice the new virtual subclass as well
+    assert perm.dispatch.call_with_key((Foo,), Foo()) == "sized"
+    assert perm.by_predicates(obj=Foo).component is perm_sized
+    assert [
+        entry.component for entry in perm.dispatch.by_predicates_many([{"obj": Foo}])
+    ] == [perm_sized]
+    assert group.resolve(Foo()) == (view.wrapped_func, perm_sized)
+
+
+def test_dispatch_virtual_subclass_order():
+    class Base:
+        pass
+
+    class Sub(Base):
+        pass
+
+    @dispatch("obj")
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "base", obj=Base)
+    f.register(lambda obj: "sized", obj=collections.abc.Sized)
+
+    class SizedSub(Sub):
+        def __len__(self):
+            return 0
+
+    # like functools.singledispatch, the explicit base classes come
+    # after the abstract base classes that are implemented
+    assert f(Sub()) == "base"
+    assert f(SizedSub()) == "sized"
+    assert f([]) == "sized"
+    assert f(object()) == "fallback"
+
+
+Protocol = getattr(typing, "Protocol", None)
+
+
+@pytest.mark.skipif(Protocol is None, reason="requires typing.Protocol")
+@pytest.mark.parametrize("get_key_lookup", [lambda r: r, DictCachingKeyLookup])
+def test_dispatch_protocol(get_key_lookup):
+    @typing.runtime_checkable
+    class Closeable(Protocol):
+        def close(self):
+            pass
+
+    class Base:
+        pass
+
+    class File(Base):
+        def close(self):
+            pass
+
+    @dispatch(match_protocol("obj"), get_key_lookup=get_key_lookup)
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "base", obj=Base)
+    f.register(lambda obj: "closeable", obj=Closeable)
+
+    assert f(File()) == "closeable"
+    assert f(Base()) == "base"
+    assert f(object()) == "fallback"
+    assert len(f.by_args(File()).all_matches) == 2
+
+
+@pytest.mark.skipif(Protocol is None, reason="requires typing.Protocol")
+def test_dispatch_protocol_not_runtime_checkable():
+    class Closeable(Protocol):
+        def close(self):
+            pass
+
+    @typing.runtime_checkable
+    class Named(Protocol):
+        name: str
+
+    @dispatch(match_protocol("obj"))
+    def f(obj):
+        return "fallback"
+
+    with pytest.raises(RegistrationError):
+        f.register(lambda obj: "closeable", obj=Closeable)
+    with pytest.raises(RegistrationError):
+        f.register(lambda obj: "named", obj=Named)
+    # the failed registrations left no trace
+    assert f(object()) == "fallback"
+    f.register(lambda obj: "object", obj=object)
+    assert f(object()) == "object"
@@ -798,3 +798,27 @@ def unmethodify(func):
     """
     func = getattr(func, "__func__", func)
     return func.__globals__.get("_func", func)
+
+
+def test_dispatch_method_resolve():
+    class Foo:
+        x = "X"
+
+        @dispatch_method(match_instance("obj"))
+        def bar(self, obj):
+            return "default"
+
+    class Alpha:
+        pass
+
+    def alpha_func(app, obj):
+        return "Alpha %s" % app.x
+
+    Foo.bar.register(alpha_func, obj=Alpha)
+    foo = Foo()
+
+    assert foo.bar.dispatch.resolve(Alpha()) is alpha_func
+    assert Foo.bar.dispatch.resolve(Alpha()) is alpha_func
+    assert foo.bar.dispatch.resolve(None) is Foo.bar.wrapped_func
+    key = foo.bar.by_args(Alpha()).key
+    assert foo.bar.dispatch.call_with_key(key, foo, Alpha()) == "Alpha X"
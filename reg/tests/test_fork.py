@@ -0,0 +1,123 @@
+import gc
+
+import pytest
+
+from ..dispatch import dispatch, prepare_for_fork
+from ..context import dispatch_method
+from ..cache import DictCachingKeyLookup
+from ..predicate import KeyIndex, Predicate
+
+
+@pytest.fixture
+def unfreeze():
+    yield
+    gc.unfreeze()
+
+
+def test_prepare_for_fork(unfreeze):
+    class Foo:
+        pass
+
+    class Bar:
+        pass
+
+    @dispatch("obj", get_key_lookup=DictCachingKeyLookup)
+    def f(obj):
+        return "fallback"
+
+    def foo(obj):
+        return "foo"
+
+    f.register(foo, obj=Foo)
+    f.register(lambda obj: "bar", obj=Bar)
+
+    indexes = f.dispatch.registry.indexes
+
+    prepare_for_fork()
+
+    component_cache = f.key_lookup.component.__self__
+    all_cache = f.key_lookup.all.__self__
+    fallback_cache = f.key_lookup.fallback.__self__
+    assert len(component_cache) == 2
+    assert component_cache[(Foo,)] is foo
+    # so is the dict calls use to look up implementations by class
+    class_implementations = f.dispatch._class_implementations
+    assert class_implementations.get(Foo.__mro__) is foo
+    assert Bar.__mro__ in class_implementations
+    assert all_cache[(Foo,)] == [foo]
+    assert fallback_cache[(Foo,)] is None
+    assert len(component_cache) == 2
+    assert gc.get_freeze_count() > 0
+
+    registry = f.dispatch.registry
+    assert registry.indexes is not indexes
+    assert registry.indexes == indexes
+    assert registry.indexes[0].fallback is indexes[0].fallback
+    assert f(Foo()) == "foo"
+
+
+def test_prepare_for_fork_no_freeze():
+    @dispatch()
+    def f():
+        return "fallback"
+
+    f.register(lambda: "registered")
+
+    prepare_for_fork(freeze=False)
+
+    assert gc.get_freeze_count() == 0
+    assert f() == "registered"
+
+
+def test_prepare_for_fork_dispatch_method():
+    class Foo:
+        pass
+
+    class App:
+        @dispatch_method("obj", get_key_lookup=DictCachingKeyLookup)
+        def f(self, obj):
+            return "fallback"
+
+    App.f.register(lambda self, obj: "foo", obj=Foo)
+
+    prepare_for_fork(freeze=False)
+
+    assert App.f.key_lookup.component.__self__[(Foo,)] is not None
+    assert App().f(Foo()) == "foo"
+
+
+def test_prepare_for_fork_unusable_key():
+    class Foo:
+        pass
+
+    @dispatch("obj", get_key_lookup=DictCachingKeyLookup)
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "default")
+    f.register(lambda obj: "foo", obj=Foo)
+
+    prepare_for_fork(freeze=False)
+
+    assert list(f.key_lookup.component.__self__) == [(Foo,)]
+    assert f(Foo()) == "foo"
+
+
+def test_prepare_for_fork_lookup_error():
+    class BrokenIndex(KeyIndex):
+        __slots__ = ()
+
+        def candidates(self, key):
+            raise ValueError("broken")
+
+    @dispatch(
+        Predicate("obj", BrokenIndex, lambda d: d["obj"]),
+        get_key_lookup=DictCachingKeyLookup,
+    )
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "a", obj="a")
+
+    with pytest.raises(ValueError):
+        f.register.__self__._prepare_for_fork()
@@ -0,0 +1,78 @@
+import subprocess
+import sys
+
+import pytest
+
+import reg
+
+
+def imported_modules(code):
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "before = set(sys.modules)\n"
+            + code
+            + "\nprint(' '.join(sorted(set(sys.modules) - before)))",
+        ]
+    )
+    return set(output.decode().split())
+
+
+def test_import_reg_is_lightweight():
+    modules = imported_modules("import reg")
+    assert "reg.dispatch" in modules
+    assert "reg.cache" not in modules
+    assert "repoze.lru" not in modules
+    assert "inspect" not in modules
+
+
+def test_dispatch_does_not_need_inspect():
+    modules = imported_modules(
+        "import reg\n"
+        "class App:\n"
+        "    @reg.dispatch_method('obj')\n"
+        "    def f(self, obj):\n"
+        "        pass\n"
+    )
+    assert "inspect" not in modules
+
+
+def test_dispatch_does_not_need_cache():
+    modules = imported_modules(
+        "import reg\n"
+        "@reg.dispatch('obj')\n"
+        "def f(obj):\n"
+        "    pass\n"
+        "f.register(lambda obj: None, obj=int)\n"
+        "f(1)\n"
+        "f.by_args(1).component\n"
+    )
+    assert "reg.dispatch" in modules
+    assert "reg.cache" not in modules
+
+
+def test_dict_caching_does_not_need_repoze():
+    modules = imported_modules("import reg\nreg.DictCachingKeyLookup")
+    assert "reg.cache" in modules
+    assert "repoze.lru" not in modules
+
+
+def test_lazy_attributes():
+    from reg.cache import (
+        DictCachingKeyLookup,
+        LruCachingKeyLookup,
+        ThreadLocalCachingKeyLookup,
+    )
+
+    assert reg.DictCachingKeyLookup is DictCachingKeyLookup
+    assert reg.LruCachingKeyLookup is LruCachingKeyLookup
+    assert reg.ThreadLocalCachingKeyLookup is ThreadLocalCachingKeyLookup
+    assert "DictCachingKeyLookup" in dir(reg)
+    assert "LruCachingKeyLookup" in dir(reg)
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        reg.doesnotexist
@@ -0,0 +1,59 @@
+import sys
+
+import pytest
+
+try:
+    import _interpreters as interpreters
+except ImportError:
+    interpreters = pytest.importorskip("_xxsubinterpreters")
+
+from ..arginfo import arginfo
+from ..dispatch import dispatch, _call_factories
+
+
+def run_in_subinterpreter(code):
+    interpreter = interpreters.create()
+    try:
+        error = interpreters.run_string(
+            interpreter, f"import sys\nsys.path[:] = {sys.path!r}\n" + code
+        )
+    finally:
+        interpreters.destroy(interpreter)
+    assert error is None
+
+
+def test_dispatch_in_subinterpreter():
+    @dispatch("obj")
+    def f(obj):
+        return "fallback"
+
+    f.register(lambda obj: "int", obj=int)
+
+    arginfo_cache = dict(arginfo._cache)
+    call_factories = dict(_call_factories)
+
+    run_in_subinterpreter("""\
+import reg
+from reg.dispatch import _call_factories
+
+@reg.dispatch('obj')
+def f(obj):
+    return 'fallback'
+
+@reg.dispatch('first', 'second')
+def g(first, second):
+    return 'fallback'
+
+f.register(lambda obj: 'str', obj=str)
+
+assert f('a') == 'str'
+assert f(1) == 'fallback'
+assert g(1, 2) == 'fallback'
+assert ('first, second', 'first=first, second=second') in _call_factories
+""")
+
+    # the subinterpreter has its own copy of reg and its state
+    assert f(1) == "int"
+    assert f("a") == "fallback"
+    assert arginfo._cache == arginfo_cache
+    assert _call_factories == call_factories
@@ -0,0 +1,77 @@
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from ..dispatch import dispatch
+from ..context import dispatch_method
+from .fixtures.pickled import title, App, SubApp, Alpha, Beta, call
+
+
+def roundtrip(obj):
+    return pickle.loads(pickle.dumps(obj))
+
+
+def test_pickle_dispatch_function():
+    assert roundtrip(title) is title
+
+
+def test_pickle_dispatch():
+    dispatch = title.register.__self__
+    assert roundtrip(dispatch) is dispatch
+
+
+def test_pickle_dispatch_method():
+    assert roundtrip(App.title) is App.title
+    assert roundtrip(SubApp.title) is SubApp.title
+    assert roundtrip(SubApp.title.register.__self__) is SubApp.title.register.__self__
+
+
+def test_dispatch_method_qualname():
+    assert App.title.__qualname__ == "App.title"
+    assert SubApp.title.__qualname__ == "SubApp.title"
+    assert SubApp.title.__module__ == App.__module__
+
+
+def test_pickle_dispatch_method_descriptor():
+    descriptor = vars(App)["title"]
+    assert roundtrip(descriptor) is descriptor
+
+
+def test_pickle_bound_dispatch_method():
+    title = roundtrip(SubApp().title)
+    assert title(Alpha()) == "default"
+    assert title(Beta()) == "sub app beta"
+
+
+def test_pickle_local_dispatch_function():
+    @dispatch("obj")
+    def f(obj):
+        pass
+
+    with pytest.raises((pickle.PicklingError, AttributeError)):
+        pickle.dumps(f)
+
+
+def test_pickle_dispatch_method_descriptor_outside_class():
+    @dispatch_method("obj")
+    def f(self, obj):
+        pass
+
+    with pytest.raises(TypeError):
+        pickle.dumps(f)
+
+
+def test_process_pool():
+    # spawn, so that the worker has to import the module to rebuild
+    # the registry
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        assert list(
+            executor.map(
+                call,
+                [title, title, App().title, SubApp().title],
+                [Alpha(), Beta(), Alpha(), Beta()],
+            )
+        ) == ["alpha", "default", "app alpha", "sub app beta"]
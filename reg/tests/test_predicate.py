@@ -1,12 +1,21 @@
 from ..predicate import (
     KeyIndex,
     ClassIndex,
+    Predicate,
     PredicateRegistry,
+    match_class,
     match_instance,
     match_key,
+    key_scope,
+    _mro_cache,
 )
+from ..dispatch import dispatch
 from ..error import RegistrationError
+import abc
+import asyncio
+import gc
 import pytest
+import weakref
 
 
 def test_key_index_permutations():
@@ -388,3 +397,353 @@ def test_nameless_predicate_key():
     p = match_key("a")
 
     assert p.key_by_predicate_name({}) is None
+
+
+class Request:
+    def __init__(self, method):
+        self.method = method
+
+
+def test_shared_key():
+    computed = []
+
+    def request_method(request):
+        computed.append(request)
+        return request.method
+
+    @dispatch("obj", match_key("method", request_method, shared=True))
+    def view(obj, request):
+        return "view fallback"
+
+    @dispatch(match_key("method", request_method, shared=True))
+    def link(request):
+        return "link fallback"
+
+    view.register(lambda obj, request: "view post", obj=object, method="POST")
+    link.register(lambda request: "link post", method="POST")
+
+    request = Request("POST")
+    other_request = Request("POST")
+    with key_scope():
+        assert view(object(), request) == "view post"
+        assert view(object(), request) == "view post"
+        assert link(request) == "link post"
+        assert link(other_request) == "link post"
+    assert computed == [request, other_request]
+
+    # outside of a scope, keys are not memoized
+    assert link(request) == "link post"
+    assert computed == [request, other_request, request]
+
+    # every scope starts anew
+    with key_scope():
+        assert link(request) == "link post"
+        with key_scope():
+            assert link(request) == "link post"
+        assert link(request) == "link post"
+    assert computed == [request, other_request, request, request, request]
+
+
+def test_shared_instance_key():
+    computed = []
+
+    def model(request):
+        computed.append(request)
+        return request.method
+
+    @dispatch(match_instance("model", model, shared=True))
+    def view(request):
+        return "fallback"
+
+    view.register(lambda request: "str", model=str)
+
+    request = Request("POST")
+    other_request = Request(None)
+    with key_scope():
+        assert view(request) == "str"
+        assert view(request) == "str"
+        assert view(other_request) == "fallback"
+    assert computed == [request, other_request]
+
+
+def test_shared_async_key():
+    computed = []
+
+    async def request_method(request):
+        computed.append(request)
+        await asyncio.sleep(0)
+        return request.method
+
+    @dispatch(match_key("method", request_method, shared=True))
+    async def view(request):
+        return "fallback"
+
+    @view.register(method="POST")
+    async def post_view(request):
+        return "post"
+
+    request = Request("POST")
+
+    async def handle():
+        with key_scope():
+            return await asyncio.gather(view(request), view(request))
+
+    assert asyncio.run(handle()) == ["post", "post"]
+    assert computed == [request]
+
+    # outside of a scope, keys are not memoized
+    assert asyncio.run(view(request)) == "post"
+    assert computed == [request, request]
+
+
+def test_shared_class_key():
+    computed = []
+
+    def model_class(request):
+        computed.append(request)
+        return type(request.method)
+
+    @dispatch(match_class("model_class", model_class, shared=True))
+    def view(request):
+        return "fallback"
+
+    view.register(lambda request: "str", model_class=str)
+
+    request = Request("POST")
+    with key_scope():
+        assert view(request) == "str"
+        assert view(request) == "str"
+    assert computed == [request]
+
+
+def test_class_index_permutations_virtual_subclass():
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    i = ClassIndex()
+    i[Sized] = {"sized"}
+    i[Foo] = {"foo"}
+
+    assert list(i.permutations(FooSub)) == [FooSub, Foo, object]
+    Sized.register(Foo)
+    assert list(i.permutations(FooSub)) == [FooSub, Foo, Sized, abc.ABC, object]
+    assert list(i.permutations(int)) == [int, object]
+
+
+def test_class_index_without_abcs_uses_mro():
+    class Foo:
+        pass
+
+    i = ClassIndex()
+    i[Foo] = {"foo"}
+    assert list(i.permutations(Foo)) == [Foo, object]
+    assert i.abcs == ()
+    assert i.permutations(Foo) is Foo.__mro__
+
+
+def test_class_index_mro_shared_between_indexes():
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    Sized.register(Foo)
+
+    i = ClassIndex()
+    i[Sized] = {"sized"}
+    j = ClassIndex()
+    j[Sized] = {"other"}
+    assert i.permutations(Foo) == (Foo, Sized, abc.ABC, object)
+    assert _mro_cache[Foo][2][(Sized,)] == (Sized, abc.ABC, object)
+    assert j.permutations(Foo) == (Foo, Sized, abc.ABC, object)
+
+
+def test_class_index_mro_bases_reassigned():
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    class Bar:
+        pass
+
+    class Qux(Foo):
+        pass
+
+    i = ClassIndex()
+    i[Sized] = {"sized"}
+    i[Foo] = {"foo"}
+    i[Bar] = {"bar"}
+
+    assert list(i.permutations(Qux)) == [Qux, Foo, object]
+    Qux.__bases__ = (Bar,)
+    assert list(i.permutations(Qux)) == [Qux, Bar, object]
+
+
+def test_class_index_mro_cache_does_not_keep_class_alive():
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    i = ClassIndex()
+    i[Sized] = {"sized"}
+    i.permutations(Foo)
+    assert Foo in _mro_cache
+    foo = weakref.ref(Foo)
+    del Foo
+    gc.collect()
+    assert foo() is None
+
+
+def test_class_index_candidates():
+    class Foo:
+        pass
+
+    class Bar(Foo):
+        pass
+
+    class Qux(Bar):
+        pass
+
+    i = ClassIndex()
+    i[Foo] = {"foo"}
+    assert i.candidates(Qux) == (Foo,)
+    assert i.candidates(int) == ()
+    i[object] = {"object"}
+    assert i.candidates(Qux) == (Foo, object)
+    i.update({Bar: {"bar"}})
+    assert i.candidates(Qux) == (Bar, Foo, object)
+
+
+def test_class_index_candidates_created_on_lookup():
+    class Foo:
+        pass
+
+    i = ClassIndex()
+    i[Foo] = {"foo"}
+    assert i._candidates is None
+    assert i.candidates(Foo) == (Foo,)
+    assert Foo in i._candidates
+    i[object] = {"object"}
+    assert i._candidates is None
+
+
+def test_class_index_candidates_bases_reassigned():
+    class Foo:
+        pass
+
+    class Bar:
+        pass
+
+    class Qux(Foo):
+        pass
+
+    i = ClassIndex()
+    i[Foo] = {"foo"}
+    i[Bar] = {"bar"}
+    assert i.candidates(Qux) == (Foo,)
+    Qux.__bases__ = (Bar,)
+    assert i.candidates(Qux) == (Bar,)
+
+
+def test_class_index_candidates_virtual_subclass():
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    i = ClassIndex()
+    i[Sized] = {"sized"}
+    assert i.candidates(Foo) == ()
+    Sized.register(Foo)
+    assert i.candidates(Foo) == (Sized,)
+
+
+def test_key_index_candidates():
+    i = KeyIndex()
+    i["GET"] = {"get"}
+    assert i.candidates("GET") == ("GET",)
+    assert i.candidates("POST") == ()
+
+
+class PathIndex(KeyIndex):
+    __slots__ = ()
+
+    def permutations(self, key):
+        parts = key.split("/")
+        return tuple("/".join(parts[:n]) for n in range(len(parts), 0, -1))
+
+
+def test_key_index_candidates_overridden_permutations():
+    i = PathIndex()
+    i["a"] = {"a"}
+    assert i.candidates("a/b/c") == ("a",)
+    i["a/b"] = {"a/b"}
+    assert i.candidates("a/b/c") == ("a/b", "a")
+    assert i.candidates("b/c") == ()
+    assert i.matches("a/b/c")
+    assert not i.matches("b/c")
+
+
+def test_dispatch_overridden_key_index_permutations():
+    @dispatch(Predicate("path", PathIndex, lambda d: d["path"]))
+    def view(path):
+        return "fallback"
+
+    def a_view(path):
+        return "a-view"
+
+    view.register(a_view, path="a")
+    assert view("a/b/c") == "a-view"
+    assert view("b/c") == "fallback"
+    assert view.by_args("a/b/c").all_matches == [a_view]
+
+
+def test_registry_deep_class_predicates():
+    classes = [object]
+    for n in range(15):
+        classes.append(type(f"C{n}", (classes[-1],), {}))
+    deep = classes[-1]
+
+    r = PredicateRegistry(match_instance("a"), match_instance("b"))
+    r.register((classes[1], classes[3]), "x")
+    r.register((classes[3], classes[1]), "y")
+    r.register((classes[3], classes[3]), "z")
+
+    assert list(r.all((deep, deep))) == ["z", "y", "x"]
+    assert r.component((classes[2], deep)) == "x"
+    assert r.component((classes[2], classes[2])) is None
+    assert r.fallback((classes[2], classes[2])) is None
+
+
+def test_registry_does_not_keep_classes_alive():
+    r = PredicateRegistry(match_instance("a"), match_instance("b"))
+    r.register((object, object), "object")
+
+    class Foo:
+        pass
+
+    assert list(r.all((Foo, Foo))) == ["object"]
+    assert r.fallback((Foo, Foo)) is None
+    foo = weakref.ref(Foo)
+    del Foo
+    gc.collect()
+    assert foo() is None
+
+
+def test_registry_accepts():
+    r = PredicateRegistry(match_instance("a"), match_key("b"))
+    assert r.accepts((int, "b"))
+    assert r.accepts((int, None))
+    assert not r.accepts((None, "b"))
@@ -1,7 +1,14 @@
 from ..predicate import PredicateRegistry, match_instance, match_key
-from ..cache import DictCachingKeyLookup, LruCachingKeyLookup
+from ..cache import (
+    DictCachingKeyLookup,
+    LruCachingKeyLookup,
+    ThreadLocalCachingKeyLookup,
+)
 from ..error import RegistrationError
-from ..dispatch import dispatch
+from ..dispatch import dispatch, LookupEntry
+import abc
+import threading
+
 import pytest
 
 
@@ -9,7 +16,10 @@ def register_value(generic, key, value):
     """Low-level function that directly uses the internal registry of the
     generic function to register an implementation.
     """
-    generic.register.__self__.registry.register(key, value)
+    dispatch = generic.dispatch
+    dispatch.registry.register(key, value)
+    # like Dispatch.register does, so that calls notice it
+    dispatch._invalidate_key_lookup()
 
 
 def test_registry():
@@ -367,3 +377,378 @@ def test_lru_caching_registry():
     assert view(Foo(), Request("dummy", "GET")) == "Name fallback"
     assert view(Foo(), Request("", "PUT")) == "Request method fallback"
     assert view(FooSub(), Request("dummy", "GET")) == "Name fallback"
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup",
+    [
+        lambda r: r,
+        DictCachingKeyLookup,
+        lambda r: LruCachingKeyLookup(r, 100, 100, 100),
+        ThreadLocalCachingKeyLookup,
+    ],
+)
+def test_register_after_call(get_key_lookup):
+    class Foo:
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    @dispatch("obj", get_key_lookup=get_key_lookup)
+    def view(obj):
+        return "fallback"
+
+    view.register(lambda obj: "foo", obj=Foo)
+
+    assert view(FooSub()) == "foo"
+    assert view.by_args(FooSub()).all_matches == [view.by_args(Foo()).component]
+
+    view.register(lambda obj: "foo sub", obj=FooSub)
+
+    assert view(FooSub()) == "foo sub"
+    assert len(view.by_args(FooSub()).all_matches) == 2
+
+
+def test_register_does_not_mutate_published_snapshot():
+    r = PredicateRegistry(match_key("a"), match_key("b"))
+    r.register(("A", "x"), "x value")
+    snapshot = r.snapshot()
+    assert r.snapshot() is snapshot
+    r.register(("A", "y"), "y value")
+    r.register(("B", "y"), "other value")
+    assert snapshot.indexes[0] == {"A": {"x value"}}
+    assert snapshot.known_values == {"x value"}
+    assert list(r.all(("A", "y"))) == ["y value"]
+    # the registrations are published at once, on the first lookup
+    new_snapshot = r.snapshot()
+    assert new_snapshot is not snapshot
+    assert new_snapshot.indexes[0] == {
+        "A": {"x value", "y value"},
+        "B": {"other value"},
+    }
+    assert new_snapshot.indexes[1] is not snapshot.indexes[1]
+    assert new_snapshot.known_values == {"x value", "y value", "other value"}
+    assert r.snapshot() is new_snapshot
+    assert r.get(("A", "y")) == {"y value"}
+    assert r.get(("C", "y")) == set()
+
+
+def test_register_counts_generations():
+    r = PredicateRegistry(match_key("a"))
+    assert r.generation == 0
+    r.register(("A",), "a value")
+    r.register(("B",), "b value")
+    assert r.generation == 2
+    with pytest.raises(RegistrationError):
+        r.register(("A",), "other value")
+    assert r.generation == 2
+
+
+def test_key_lookup_published_once_for_registrations():
+    registries = []
+
+    def get_key_lookup(r):
+        registries.append(r)
+        return DictCachingKeyLookup(r)
+
+    @dispatch("obj", get_key_lookup=get_key_lookup)
+    def view(obj):
+        return "fallback"
+
+    class Foo:
+        pass
+
+    def foo(obj):
+        return "foo"
+
+    def anything(obj):
+        return "object"
+
+    assert view(Foo()) == "fallback"
+    assert len(registries) == 1
+    view.register(foo, obj=Foo)
+    view.register(lambda obj: "int", obj=int)
+    assert len(registries) == 1
+    assert view(Foo()) == "foo"
+    assert view(1) == "int"
+    assert len(registries) == 2
+    assert view.by_predicates(obj=Foo).all_matches == [foo]
+    # methods that don't compute a key also notice registrations
+    view.register(anything, obj=object)
+    assert view.by_predicates(obj=Foo).all_matches == [foo, anything]
+    assert view.dispatch.call_with_key((str,), "a") == "object"
+    assert len(registries) == 3
+
+
+def test_register_while_key_lookup_published():
+    pending = []
+
+    def get_key_lookup(r):
+        key_lookup = DictCachingKeyLookup(r)
+        # stands in for a call and a registration in other threads
+        while pending:
+            pending.pop()(key_lookup)
+        return key_lookup
+
+    @dispatch(match_key("name"), get_key_lookup=get_key_lookup)
+    def view(name):
+        return "fallback"
+
+    def foo(name):
+        return "foo"
+
+    def register_foo(key_lookup):
+        key_lookup.component(("foo",))
+        view.register(foo, name="foo")
+
+    view.register(lambda name: "bar", name="bar")
+    pending.append(register_foo)
+    # this call publishes a key lookup that cached its component
+    # before the registration
+    assert view("foo") == "fallback"
+    assert view("foo") == "foo"
+
+
+def test_register_abc_after_lookup():
+    class Sized(abc.ABC):
+        pass
+
+    class Foo:
+        pass
+
+    Sized.register(Foo)
+
+    r = PredicateRegistry(match_instance("obj"))
+    r.register((Foo,), "foo")
+    assert not r.uses_abcs()
+    assert list(r.all((Foo,))) == ["foo"]
+    r.register((Sized,), "sized")
+    assert r.uses_abcs()
+    assert list(r.all((Foo,))) == ["foo", "sized"]
+
+
+def test_thread_local_caching_registry():
+    class Foo:
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    class Bar:
+        pass
+
+    @dispatch("obj", get_key_lookup=ThreadLocalCachingKeyLookup)
+    def view(obj):
+        return "fallback"
+
+    def foo(obj):
+        return "foo"
+
+    view.register(foo, obj=Foo)
+
+    assert view(FooSub()) == "foo"
+    assert view(Bar()) == "fallback"
+    assert view.by_args(FooSub()).all_matches == [foo]
+    assert view.by_args(FooSub()).fallback is None
+    assert view.by_args(Bar()).component is None
+
+    # these come from the cache now
+    assert view(FooSub()) == "foo"
+    assert view(Bar()) == "fallback"
+    assert view.by_args(FooSub()).all_matches == [foo]
+
+    # another thread starts out without a cache
+    caches = view.key_lookup.component.__closure__[0].cell_contents
+    assert (FooSub,) in caches.cache
+
+    def other_thread():
+        assert not hasattr(caches, "cache")
+        assert view(FooSub()) == "foo"
+        assert (FooSub,) in caches.cache
+        results.append(caches.cache)
+
+    results = []
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    thread.join()
+    assert len(results) == 1
+    assert results[0] is not caches.cache
+
+
+def test_lazy_registry():
+    computed = []
+
+    def get_name(obj, name):
+        computed.append(name)
+        return name
+
+    class Foo:
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    r = PredicateRegistry(
+        match_instance("obj", fallback="no obj"),
+        match_key("name", get_name, fallback="no name"),
+        lazy=True,
+    )
+    r.register((Foo, "a"), "foo a")
+
+    assert r.key(obj=FooSub(), name="a") == (FooSub, "a")
+    assert computed == ["a"]
+    assert r.component((FooSub, "a")) == "foo a"
+
+    # the name is not computed when no implementation is registered for obj
+    assert r.key(obj=object(), name="a") == (object,)
+    assert computed == ["a"]
+    assert r.component((object,)) is None
+    assert r.fallback((object,)) == "no obj"
+
+    assert r.key(obj=Foo(), name="b") == (Foo, "b")
+    assert computed == ["a", "b"]
+    assert r.component((Foo, "b")) is None
+    assert r.fallback((Foo, "b")) == "no name"
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup",
+    [
+        lambda r: r,
+        DictCachingKeyLookup,
+        lambda r: LruCachingKeyLookup(r, 100, 100, 100),
+        ThreadLocalCachingKeyLookup,
+    ],
+)
+def test_lazy_dispatch(get_key_lookup):
+    computed = []
+
+    def get_name(obj, name):
+        computed.append(name)
+        return name
+
+    class Foo:
+        pass
+
+    @dispatch(
+        "obj",
+        match_key("name", get_name, fallback=lambda obj, name: "no name"),
+        get_key_lookup=get_key_lookup,
+        lazy=True,
+    )
+    def view(obj, name):
+        return "fallback"
+
+    view.register(lambda obj, name: "foo a", obj=Foo, name="a")
+
+    assert view(Foo(), "a") == "foo a"
+    assert view(Foo(), "b") == "no name"
+    assert computed == ["a", "b"]
+    assert view(object(), "a") == "fallback"
+    assert view.by_args(object(), "a").key == (object,)
+    assert computed == ["a", "b"]
+
+    view.register(lambda obj, name: "object a", obj=object, name="a")
+    assert view(object(), "a") == "object a"
+    assert computed == ["a", "b", "a"]
+
+
+class CountingRegistry:
+    def __init__(self, registry):
+        self.registry = registry
+        self.calls = []
+
+    def component(self, key):
+        self.calls.append("component")
+        return self.registry.component(key)
+
+    def fallback(self, key):
+        self.calls.append("fallback")
+        return self.registry.fallback(key)
+
+    def all(self, key):
+        self.calls.append("all")
+        return self.registry.all(key)
+
+
+def test_lookup_entries_are_interned():
+    class Foo:
+        pass
+
+    @dispatch("obj", get_key_lookup=DictCachingKeyLookup)
+    def view(obj):
+        return "fallback"
+
+    view.register(lambda obj: "foo", obj=Foo)
+
+    entry = view.by_args(Foo())
+    assert view.by_args(Foo()) is entry
+    assert view.by_predicates(obj=Foo) is entry
+    assert view.dispatch.by_args_many([(Foo(),)]) == [entry]
+    assert view.by_args(object()) is not entry
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup",
+    [
+        lambda r: r,
+        lambda r: LruCachingKeyLookup(r, 10, 10, 10),
+    ],
+)
+def test_lookup_entries_are_not_interned_without_unbounded_cache(get_key_lookup):
+    @dispatch("key", get_key_lookup=get_key_lookup)
+    def view(key):
+        return "fallback"
+
+    view.register(lambda key: "foo", key=str)
+
+    for i in range(100):
+        assert view.by_args(str(i)).component is not None
+    assert view.by_args("a") is not view.by_args("a")
+    assert view.by_predicates(key=str) == view.by_args("a")
+    assert view.register.__self__._entries is None
+
+    # arguments with the same key still share one entry
+    first, second = view.dispatch.by_args_many([("a",), ("b",)])
+    assert first is second
+
+
+def test_lookup_entry_computes_once():
+    class Foo:
+        pass
+
+    @dispatch("obj", get_key_lookup=CountingRegistry)
+    def view(obj):
+        return "fallback"
+
+    view.register(lambda obj: "foo", obj=Foo)
+
+    entry = view.by_args(Foo())
+    for i in range(2):
+        assert entry.component is not None
+        assert entry.fallback is None
+        assert len(entry.all_matches) == 1
+        assert len(list(entry.matches)) == 1
+    # each property is computed once
+    assert view.key_lookup.calls == ["component", "fallback", "all"]
+    assert LookupEntry.component.__doc__ == (
+        "The function to dispatch to, excluding fallbacks."
+    )
+
+
+def test_lookup_entries_after_register():
+    class Foo:
+        pass
+
+    @dispatch("obj")
+    def view(obj):
+        return "fallback"
+
+    entry = view.by_args(Foo())
+    assert entry.component is None
+
+    foo = view.register(lambda obj: "foo", obj=Foo)
+
+    assert view.by_args(Foo()) is not entry
+    assert view.by_args(Foo()).component is foo
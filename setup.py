@@ -19,11 +19,11 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
+    python_requires=">=3.7",
     classifiers=[
         "Intended Audience :: Developers",
         "License :: OSI Approved :: BSD License",
         "Topic :: Software Development :: Libraries :: Python Modules",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
@@ -32,7 +32,14 @@ setup(
     ],
     install_requires=["setuptools", "repoze.lru"],
     extras_require=dict(
-        test=["pytest >= 2.9.0", "sphinx", "pytest-remove-stale-bytecode"],
+        test=[
+            "pytest >= 2.9.0",
+            "sphinx",
+            "pytest-remove-stale-bytecode",
+        ],
+        # NumPy 1.23 is the first to build arrays of objects from
+        # iterators, and it needs Python 3.8.
+        numpy=['numpy >= 1.23; python_version >= "3.8"'],
         pep8=["flake8", "black"],
         coverage=["pytest-cov"],
         docs=["sphinx"],